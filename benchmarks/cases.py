@@ -0,0 +1,93 @@
+import contextlib
+import io
+import os
+import time
+from .data import TARGET
+
+# Each case runs in its own process: it does its setup, then times only the
+# operation under test and returns (seconds, rows processed).
+
+def _columns(directory):
+    import pyarrow.parquet as pq
+    return pq.read_schema(os.path.join(directory, 'train.parquet')).names
+
+def _dataset(directory):
+    from modeling import Dataset
+    from modeling.sources import LocalSource
+    with contextlib.redirect_stdout(io.StringIO()):
+        return Dataset(columns=_columns(directory), source=LocalSource(directory))
+
+def load(directory, format='parquet'):
+    from modeling import Dataset
+    from modeling.sources import LocalSource
+    source = LocalSource(directory if format == 'parquet' else os.path.join(directory, 'csv'))
+    columns = _columns(directory)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        dataset = Dataset(columns=columns, source=source)
+    return time.perf_counter() - start, len(dataset.data)
+
+def train(directory, degree=2, solver='normal'):
+    from modeling import Model
+    dataset = _dataset(directory)
+    model = Model()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        model.train(TARGET, dataset, degree=degree, solver=solver)
+    return time.perf_counter() - start, len(dataset.data)
+
+def predict(directory, degree=2):
+    from modeling import Model
+    dataset = _dataset(directory)
+    model = Model()
+    with contextlib.redirect_stdout(io.StringIO()):
+        model.train(TARGET, dataset, degree=degree, solver='normal')
+    X = dataset.array(model.features)
+    start = time.perf_counter()
+    model.predict(X)
+    return time.perf_counter() - start, len(X)
+
+def metrics(directory):
+    import numpy as np
+    from modeling.metrics import regression_metrics
+    dataset = _dataset(directory)
+    y_true = dataset.array([TARGET]).ravel()
+    y_pred = y_true + np.random.default_rng(0).normal(0.0, 3.0, len(y_true))
+    start = time.perf_counter()
+    regression_metrics(y_true, y_pred)
+    return time.perf_counter() - start, len(y_true)
+
+def subsets(directory, maxFeatures=3, workers=1):
+    from scripts import CalculateLinearModels
+    path = os.path.join(directory, 'csv', 'train.csv')
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        CalculateLinearModels(path, maxFeatures, 5, TARGET, workers=workers)
+    rows = sum(1 for _ in open(path)) - 1
+    return time.perf_counter() - start, rows
+
+CASES = {
+    'load': load,
+    'train': train,
+    'predict': predict,
+    'metrics': metrics,
+    'subsets': subsets,
+}
+
+# The default matrix: every case with each parameter set, at every size.
+DEFAULT_MATRIX = [
+    ('load', {'format': 'parquet'}),
+    ('load', {'format': 'csv'}),
+    ('train', {'degree': 1}),
+    ('train', {'degree': 2}),
+    ('train', {'degree': 3}),
+    ('predict', {'degree': 2}),
+    ('predict', {'degree': 3}),
+    ('metrics', {}),
+    ('subsets', {'maxFeatures': 2}),
+    ('subsets', {'maxFeatures': 4}),
+    ('subsets', {'maxFeatures': 6}),
+]
+
+def needs_csv(case, params):
+    return case == 'subsets' or params.get('format') == 'csv'
@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import pandas as pd
+
+# (mean, standard deviation) of the GSOD measurements, roughly as observed
+MEASUREMENTS = {
+    'dewp': (41.5, 20.6),
+    'slp': (1014.2, 8.1),
+    'stp': (968.3, 73.2),
+    'visib': (11.8, 8.9),
+    'wdsp': (6.9, 4.6),
+    'prcp': (0.09, 0.31),
+    'altitude': (420.0, 610.0),
+    'longitude': (10.0, 80.0),
+    'latitude': (32.0, 25.0),
+}
+FLAGS = ('fog', 'rain_drizzle', 'snow_ice_pellets', 'hail', 'thunder', 'tornado_funnel_cloud')
+TARGET = 'temp'
+
+def feature_names(features):
+    names = ['mo'] + list(MEASUREMENTS) + list(FLAGS)
+    names += ['extra_{}'.format(i) for i in range(max(0, features - len(names)))]
+    return names[:features]
+
+def synthetic_gsod(rows, features=10, seed=0):
+    """GSOD-shaped frame with `features` feature columns and a temp target
+    that depends on season, dew point and latitude."""
+    rng = np.random.default_rng(seed)
+    data = {}
+    for name in feature_names(features):
+        if name == 'mo':
+            data[name] = rng.integers(1, 13, rows).astype(np.float64)
+        elif name in MEASUREMENTS:
+            mean, sd = MEASUREMENTS[name]
+            data[name] = rng.normal(mean, sd, rows)
+        elif name in FLAGS:
+            data[name] = (rng.random(rows) < 0.05).astype(np.float64)
+        else:
+            data[name] = rng.normal(0.0, 1.0, rows)
+    season = np.cos((data['mo'] - 7) * np.pi / 6) if 'mo' in data else 0.0
+    temp = 55.7 + 18.0 * season + rng.normal(0.0, 6.0, rows)
+    if 'dewp' in data:
+        temp += 0.6 * (data['dewp'] - MEASUREMENTS['dewp'][0])
+    if 'latitude' in data:
+        temp -= 0.3 * (data['latitude'] - MEASUREMENTS['latitude'][0])
+    data[TARGET] = temp
+    return pd.DataFrame(data)
+
+def ensure_data(root, rows, features=10, seed=0, csv=False):
+    """Writes train/test Parquet files (and optionally CSV copies) for one
+    size once and reuses them on later runs."""
+    directory = os.path.join(root, 'gsod-{}-{}-{}'.format(rows, features, seed))
+    os.makedirs(os.path.join(directory, 'csv'), exist_ok=True)
+    for table, table_rows, table_seed in (('train', rows, seed), ('test', max(1, rows // 5), seed + 1)):
+        path = os.path.join(directory, table + '.parquet')
+        csv_path = os.path.join(directory, 'csv', table + '.csv')
+        if os.path.exists(path) and (not csv or os.path.exists(csv_path)):
+            continue
+        data = synthetic_gsod(table_rows, features, table_seed)
+        if not os.path.exists(path):
+            data.to_parquet(path + '.tmp', index=False)
+            os.replace(path + '.tmp', path)
+        if csv and not os.path.exists(csv_path):
+            data.to_csv(csv_path + '.tmp', index=False)
+            os.replace(csv_path + '.tmp', csv_path)
+    return directory
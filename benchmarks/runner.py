@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from . import cases
+from .data import ensure_data
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+
+def case_name(case, params, rows, features):
+    settings = ','.join('{}={}'.format(k, v) for k, v in sorted(params.items()))
+    return '{}[{}]/rows={}/features={}'.format(case, settings, rows, features)
+
+def run_child(spec):
+    # Runs in a fresh interpreter so peak RSS belongs to this case alone.
+    function = cases.CASES[spec['case']]
+    timings = []
+    for _ in range(spec['repeat']):
+        seconds, rows = function(spec['directory'], **spec['params'])
+        timings.append(seconds)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform != 'darwin':
+        peak *= 1024
+    seconds = min(timings)
+    return {'seconds': seconds, 'timings': timings, 'rows': rows,
+            'rows_per_second': rows / seconds if seconds > 0 else None, 'peak_rss_bytes': peak}
+
+def run_case(case, params, rows, features, data_root, repeat=3, seed=0, timeout=None):
+    directory = ensure_data(data_root, rows, features, seed, csv=cases.needs_csv(case, params))
+    spec = {'case': case, 'params': params, 'directory': directory, 'repeat': repeat}
+    name = case_name(case, params, rows, features)
+    print("  --> {}...".format(name), end=' ', flush=True)
+    process = subprocess.run([sys.executable, '-m', 'benchmarks.runner', '--child', json.dumps(spec)],
+                             cwd=ROOT, capture_output=True, text=True, timeout=timeout)
+    record = {'name': name, 'case': case, 'params': params, 'rows': rows, 'features': features}
+    if process.returncode != 0:
+        record['error'] = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else 'exit {}'.format(process.returncode)
+        print("failed ({})".format(record['error']))
+        return record
+    record.update(json.loads(process.stdout.strip().splitlines()[-1]))
+    print("{:.4f} s, {:.0f} rows/s, {:.0f} MiB peak".format(record['seconds'], record['rows_per_second'] or 0, record['peak_rss_bytes'] / 2**20))
+    return record
+
+def run(sizes=(10000, 100000, 1000000), features=10, selected=None, repeat=3, data_root=None, subset_rows=100000, seed=0):
+    data_root = data_root or os.path.join(ROOT, 'benchmarks', 'data')
+    matrix = [(case, params) for case, params in cases.DEFAULT_MATRIX if selected is None or case in selected]
+    results = []
+    seen = set()
+    for rows in sizes:
+        for case, params in matrix:
+            # the subset search reads CSV and is bounded by the subset count, not rows
+            case_rows = min(rows, subset_rows) if case == 'subsets' else rows
+            if (case, json.dumps(params, sort_keys=True), case_rows) in seen:
+                continue
+            seen.add((case, json.dumps(params, sort_keys=True), case_rows))
+            results.append(run_case(case, params, case_rows, features, data_root, repeat, seed))
+    import numpy
+    return {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+            'numpy': numpy.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'results': results}
+
+def compare(report, baseline, tolerance=0.2):
+    """Cases whose time or peak memory grew by more than tolerance over the
+    baseline, as (name, metric, baseline value, current value)."""
+    previous = dict((r['name'], r) for r in baseline['results'] if 'error' not in r)
+    regressions = []
+    for record in report['results']:
+        if 'error' in record or record['name'] not in previous:
+            continue
+        for metric in ('seconds', 'peak_rss_bytes'):
+            before = previous[record['name']][metric]
+            if before and record[metric] > before * (1 + tolerance):
+                regressions.append((record['name'], metric, before, record[metric]))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description='Time the modeling and subset search hot paths.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000], help='dataset sizes, e.g. 10000 ... 10000000')
+    parser.add_argument('--features', type=int, default=10)
+    parser.add_argument('--cases', nargs='+', choices=sorted(cases.CASES), default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--subset-rows', type=int, default=100000, help='row cap for the subset search cases')
+    parser.add_argument('--data', default=None, help='directory for generated data (default benchmarks/data)')
+    parser.add_argument('--output', default=None, help='write the JSON report here')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true', help='store this run as the baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown or memory growth')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child is not None:
+        print(json.dumps(run_child(json.loads(args.child))))
+        return 0
+
+    report = run(args.rows, args.features, args.cases, args.repeat, args.data, args.subset_rows)
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=1)
+    # a failed case fails the run whether or not there is a baseline
+    failed = sum('error' in r for r in report['results'])
+    if failed:
+        print("{} cases failed.".format(failed))
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=1)
+        print("Baseline saved to {}".format(args.baseline))
+        return 1 if failed else 0
+    if not os.path.exists(args.baseline):
+        print("No baseline at {}; run with --save-baseline to create one.".format(args.baseline))
+        return 1 if failed else 0
+    with open(args.baseline) as file:
+        regressions = compare(report, json.load(file), args.tolerance)
+    for name, metric, before, after in regressions:
+        print("REGRESSION {} {}: {:.4g} -> {:.4g} ({:+.0%})".format(name, metric, before, after, after / before - 1))
+    return 1 if failed or regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
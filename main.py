@@ -31,10 +31,12 @@ def main():
             maxPredictors = input("Enter maximum number of parameters allowed in model: ")
             numModels = input("Enter number of models to be kept: ")
             outcomeName = input("Enter outcome column name: ")
+            workers = input("Enter number of worker processes [1]: ") or 1
             maxPredictors = int(maxPredictors)
             numModels = int(numModels)
+            workers = int(workers)
             print("")
-            models = CalculateLinearModels(fileName, maxPredictors, numModels, outcomeName)
+            models = CalculateLinearModels(fileName, maxPredictors, numModels, outcomeName, workers=workers)
         elif(choice == 2):
             models.summarizeModels()
         elif(choice == 3):
@@ -1,3 +1,5 @@
 from .dataset import Dataset
 from .model import Model
-from .polyreg import PolyReg
\ No newline at end of file
+from .classifier import Classifier
+from .polyreg import PolyReg
+from .stats import SufficientStats
\ No newline at end of file
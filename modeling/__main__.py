@@ -1,2 +1,10 @@
-from . import main
-main.main()
\ No newline at end of file
+import sys
+if len(sys.argv) > 1 and sys.argv[1] in ('score', 'serve'):
+    from . import score
+    score.main(sys.argv[1:])
+elif len(sys.argv) > 1 and sys.argv[1] == 'sweep':
+    from . import sweep
+    sweep.main(sys.argv[2:])
+else:
+    from . import main
+    main.main()
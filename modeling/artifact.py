@@ -0,0 +1,125 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from .stats import SufficientStats
+from .model import Model
+from .regions import GridIndex, RegionalModel
+
+# On-disk layout of a saved PolyReg:
+#
+#   <path>/model.json               header: target, features, degree, monomial
+#                                   powers, coefficients, metrics, dataset index
+#   <path>/data/<name>/<column>.npy raw column arrays, memory-mapped on load
+#   <path>/stats.npz                sufficient statistics of the training rows,
+#                                   for update/downdate without retraining
+#   <path>/regions/<cell>/          per-region models of a regional PolyReg,
+#                                   each a header and stats.npz of its own
+#
+# Loading a model for scoring only parses the header; the data files are
+# not opened until a dataset's frame is first used.
+ARTIFACT_FORMAT = 'polyreg'
+ARTIFACT_VERSION = 1
+HEADER_NAME = 'model.json'
+
+def is_artifact(path):
+    return os.path.exists(os.path.join(path, HEADER_NAME))
+
+def read_header(path):
+    with open(os.path.join(path, HEADER_NAME)) as file:
+        header = json.load(file)
+    if header.get('format') != ARTIFACT_FORMAT:
+        raise ValueError("{} is not a PolyReg artifact.".format(path))
+    if header.get('version', 0) > ARTIFACT_VERSION:
+        raise ValueError("PolyReg artifact version {} is newer than supported version {}.".format(header['version'], ARTIFACT_VERSION))
+    return header
+
+def write_header(path, header):
+    os.makedirs(path, exist_ok=True)
+    header = dict(header, format=ARTIFACT_FORMAT, version=ARTIFACT_VERSION)
+    with open(os.path.join(path, HEADER_NAME) + '.tmp', 'w') as file:
+        json.dump(header, file, indent=1)
+    os.replace(os.path.join(path, HEADER_NAME) + '.tmp', os.path.join(path, HEADER_NAME))
+
+def update_header(path, **fields):
+    header = read_header(path) if is_artifact(path) else {}
+    header.update(fields)
+    write_header(path, header)
+    return header
+
+def write_dataset(path, name, data):
+    directory = os.path.join(path, 'data', name)
+    os.makedirs(directory, exist_ok=True)
+    columns = {}
+    for column in data.columns:
+        file = os.path.join('data', name, '{}.npy'.format(column))
+        values = np.ascontiguousarray(data[column].to_numpy())
+        np.save(os.path.join(path, file), values)
+        columns[column] = {'file': file, 'dtype': values.dtype.str}
+    entry = {'rows': len(data), 'columns': columns}
+    header = read_header(path) if is_artifact(path) else {}
+    datasets = header.get('datasets', {})
+    datasets[name] = entry
+    update_header(path, datasets=datasets)
+    return entry
+
+def read_dataset(path, name, columns=None):
+    entry = read_header(path).get('datasets', {}).get(name)
+    if entry is None:
+        return None
+    names = list(columns) if columns is not None else list(entry['columns'])
+    return pd.DataFrame(dict((c, np.load(os.path.join(path, entry['columns'][c]['file']), mmap_mode='r')) for c in names),
+                        columns=names, copy=False)
+
+def dataset_columns(path, name):
+    entry = read_header(path).get('datasets', {}).get(name)
+    return list(entry['columns']) if entry is not None else None
+
+def write_stats(path, stats, file='stats.npz'):
+    stats.save(os.path.join(path, file + '.tmp.npz'))
+    os.replace(os.path.join(path, file + '.tmp.npz'), os.path.join(path, file))
+    return update_header(path, stats={'file': file, 'rows': stats.rows, 'terms': stats.n_terms})
+
+def remove_stats(path, file='stats.npz'):
+    # a model solved without statistics must not inherit the previous ones
+    entry = read_header(path).get('stats') if is_artifact(path) else None
+    for name in set([file] + ([entry['file']] if entry else [])):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+    return update_header(path, stats=None)
+
+def read_stats(path):
+    entry = read_header(path).get('stats')
+    if entry is None or not os.path.exists(os.path.join(path, entry['file'])):
+        return None
+    return SufficientStats.load(os.path.join(path, entry['file']))
+
+def write_regions(path, regions):
+    """Writes each region's model under regions/<cell>/; the fallback model
+    is the artifact's own."""
+    entry = regions.describe()
+    for cell, model in regions.models.items():
+        directory = os.path.join('regions', str(cell))
+        write_header(os.path.join(path, directory), dict(model.describe(), target=model.target[0]))
+        if model.stats is not None:
+            write_stats(os.path.join(path, directory), model.stats)
+        else:
+            remove_stats(os.path.join(path, directory))
+        entry['cells'][str(cell)]['dir'] = directory
+    return update_header(path, regions=entry)
+
+def read_regions(path, fallback):
+    entry = read_header(path).get('regions')
+    if entry is None:
+        return None
+    models = {}
+    for cell, region in entry['cells'].items():
+        directory = os.path.join(path, region['dir'])
+        header = read_header(directory)
+        model = Model()
+        model.restore(header['target'], header['features'], header['degree'], header['coef'], header['intercept'],
+                      stats=read_stats(directory), powers=header.get('powers'))
+        models[int(cell)] = model
+    regions = RegionalModel(GridIndex(**entry['index']))
+    regions.restore(fallback, models, min_rows=entry.get('min_rows'))
+    return regions
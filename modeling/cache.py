@@ -0,0 +1,134 @@
+import hashlib
+import json
+import os
+import time
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# the BigQuery dataset Dataset reads when it has no other source
+DEFAULT_SOURCE = 'bigquery:to-hail-or-not-to-hail.gsod_copy'
+
+def read_manifest(path):
+    """A JSON manifest, or {} when there is none yet."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+def write_manifest(path, manifest):
+    # written beside the old one and renamed over it, so readers never see
+    # a partial manifest
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + '.tmp', path)
+
+def source_identity(source):
+    """Stable name of where rows come from: a source's identity (e.g. a
+    LocalSource's directory), or the default BigQuery dataset."""
+    if source is None:
+        return DEFAULT_SOURCE
+    if isinstance(source, str):
+        return source
+    return getattr(source, 'identity', type(source).__name__)
+
+class DatasetCache():
+    """Content-addressed on-disk cache of loaded Dataset frames.
+
+    Each (source, table_name, columns, max_size, data_where) result is
+    stored as a compressed Parquet file named by the hash of its key, and a
+    JSON manifest tracks size and last access for least-recently-used
+    eviction.
+    """
+    manifest_name = 'manifest.json'
+
+    def __init__(self, directory=os.path.dirname(os.path.abspath(__file__))+'/cache/', max_bytes=8*2**30, max_entries=None, compression='zstd'):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.compression = compression
+        os.makedirs(self.directory, exist_ok=True)
+        self._manifest = self._read_manifest()
+
+    @classmethod
+    def describe(cls, table_name, columns, max_size, data_where, source=None):
+        if callable(data_where):
+            return None
+        return {'source': source_identity(source),
+                'table_name': table_name,
+                'columns': list(columns) if columns is not None else None,
+                'max_size': max_size,
+                'data_where': None if data_where is None else repr(data_where)}
+
+    @classmethod
+    def key(cls, table_name, columns, max_size, data_where, source=None):
+        description = cls.describe(table_name, columns, max_size, data_where, source)
+        if description is None:
+            return None
+        return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()
+
+    def get(self, table_name, columns, max_size=None, data_where=None, source=None):
+        key = self.key(table_name, columns, max_size, data_where, source)
+        entry = self._manifest.get(key) if key is not None else None
+        if entry is None:
+            return None
+        path = os.path.join(self.directory, entry['file'])
+        if not os.path.exists(path):
+            del self._manifest[key]
+            self._write_manifest()
+            return None
+        data = pq.read_table(path, memory_map=True).to_pandas()
+        entry['last_access'] = time.time()
+        entry['hits'] = entry.get('hits', 0) + 1
+        self._write_manifest()
+        return data
+
+    def put(self, table_name, columns, max_size, data_where, data, source=None):
+        key = self.key(table_name, columns, max_size, data_where, source)
+        if key is None:
+            return None
+        file = key + '.parquet'
+        path = os.path.join(self.directory, file)
+        table = pa.Table.from_pandas(data, preserve_index=False)
+        pq.write_table(table, path + '.tmp', compression=self.compression)
+        os.replace(path + '.tmp', path)
+        now = time.time()
+        entry = self.describe(table_name, columns, max_size, data_where, source)
+        entry.update({'file': file, 'rows': len(data), 'bytes': os.path.getsize(path),
+                      'created': now, 'last_access': now, 'hits': 0})
+        self._manifest[key] = entry
+        self.evict()
+        return key
+
+    def evict(self):
+        entries = sorted(self._manifest.items(), key=lambda kv: kv[1]['last_access'])
+        total = sum(entry['bytes'] for _, entry in entries)
+        while entries and (total > self.max_bytes or (self.max_entries is not None and len(entries) > self.max_entries)):
+            key, entry = entries.pop(0)
+            total -= entry['bytes']
+            self._remove(key)
+        self._write_manifest()
+
+    def clear(self):
+        for key in list(self._manifest):
+            self._remove(key)
+        self._write_manifest()
+
+    def _remove(self, key):
+        entry = self._manifest.pop(key)
+        path = os.path.join(self.directory, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _read_manifest(self):
+        return read_manifest(os.path.join(self.directory, self.manifest_name))
+
+    def _write_manifest(self):
+        write_manifest(os.path.join(self.directory, self.manifest_name), self._manifest)
+
+    @property
+    def entries(self):
+        return dict(self._manifest)
+
+    @property
+    def size(self):
+        return sum(entry['bytes'] for entry in self._manifest.values())
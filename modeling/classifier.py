@@ -0,0 +1,99 @@
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from .metrics import ClassificationMetrics
+from .expansion import make_expansion
+from .instrument import stage
+
+class Classifier():
+    """Logistic regression on polynomial terms for a binary target such as
+    hail, trained on a (downsampled) Dataset with its importance weights."""
+    def __init__(self, C=1.0, max_iter=500, threshold=0.5):
+        self._target = None
+        self._features = None
+        self._model = None
+        self._degree = None
+        self._C = C
+        self._max_iter = max_iter
+        self.threshold = threshold
+
+    def train(self, target, train_data, degree=1, write=None, chunk_size=250000):
+        if self._model is not None:
+            print("Warning: Existing classifier will be overwritten.")
+        self._target = [target]
+        self._features = [c for c in train_data.columns if c != target]
+        self._degree = degree
+        self._model = self._build_pipeline()
+        # the training sample is small once downsampled, so it is fit in memory
+        X, y, weights = self._gather(train_data, chunk_size)
+        if len(y) == 0:
+            raise ValueError("No training data.")
+        if y.min() == y.max():
+            raise ValueError("Training data for '{}' has only one class.".format(target))
+        with stage("Training classifier", write=write, degree=degree, rows=len(y), positives=int(y.sum())):
+            self._model.fit(X, y, classifier__sample_weight=weights)
+        with stage("Scoring train data", write=write, rows=len(y)):
+            metrics = ClassificationMetrics(threshold=self.threshold)
+            metrics.update(y, self.predict_proba(X), weights)
+        return metrics.results()
+
+    def test(self, test_data, write=None, chunk_size=250000):
+        # Streams the test table; a downsampled test set is reweighted back
+        # to the full table's class balance.
+        with stage("Scoring test data in chunks", write=write) as span:
+            metrics = ClassificationMetrics(threshold=self.threshold)
+            for X, y, weights in test_data.iter_arrays(self.features, self.target, chunk_size, dtype=None, weights=True):
+                metrics.update(y, self.predict_proba(X), weights)
+                span.add(rows=len(X))
+        return metrics.results()
+
+    def predict_proba(self, X, chunk_size=65536):
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        out = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], chunk_size):
+            out[start:start+chunk_size] = self._model.predict_proba(np.asarray(X[start:start+chunk_size], dtype=np.float64))[:, 1]
+        return out
+
+    def predict(self, X, threshold=None, chunk_size=65536):
+        return self.predict_proba(X, chunk_size) >= (self.threshold if threshold is None else threshold)
+
+    def describe(self):
+        if self._model is None:
+            return {}
+        classifier = self._model.named_steps['classifier']
+        return {'target': self._target[0], 'features': list(self._features), 'degree': self._degree,
+                'threshold': self.threshold, 'coef': classifier.coef_.ravel().tolist(),
+                'intercept': float(classifier.intercept_[0])}
+
+    def _gather(self, dataset, chunk_size):
+        Xs, ys, ws = [], [], []
+        for X, y, w in dataset.iter_arrays(self.features, self.target, chunk_size, dtype=None, weights=True):
+            Xs.append(np.asarray(X, dtype=np.float64))
+            ys.append(np.asarray(y).ravel() != 0)
+            ws.append(w)
+        if not Xs:
+            return np.empty((0, len(self.features))), np.empty(0, dtype=bool), np.empty(0)
+        return np.concatenate(Xs), np.concatenate(ys), np.concatenate(ws)
+
+    def _build_pipeline(self):
+        steps = []
+        if self._degree is not None and self._degree >= 2:
+            steps.append(('kernel', make_expansion(self._features, self._degree, include_bias=False)))
+        steps.append(('scaler', StandardScaler()))
+        steps.append(('classifier', LogisticRegression(C=self._C, max_iter=self._max_iter)))
+        return Pipeline(steps)
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def features(self):
+        return self._features
+
+    @property
+    def model(self):
+        return self._model
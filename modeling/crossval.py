@@ -0,0 +1,99 @@
+import numpy as np
+import pandas as pd
+from .model import Model
+from .stats import SufficientStats
+from .expansion import make_expansion, accumulate
+from .instrument import stage
+
+def fold_ids(values, k, seed=0):
+    """Fold of each row's group value (a station id, a year, ...). Values are
+    hashed, so a group lands in the same fold in every chunk and every run."""
+    hashes = pd.util.hash_array(np.asarray(values))
+    if seed:
+        hashes = pd.util.hash_array(hashes ^ np.uint64(seed))
+    return (hashes % np.uint64(k)).astype(np.int64)
+
+class CrossValidation():
+    """K-fold cross-validation from per-fold sufficient statistics.
+
+    One pass over the data folds each row's polynomial terms into the
+    SufficientStats of its fold. Fold i's model is solved from the total
+    minus fold i, and its held-out metrics come from fold i's own
+    statistics, so k fits cost one expansion of the data plus k small
+    solves. Folds are random rows, or whole groups of a column such as
+    'stn' (station) or 'year', so neighbouring days of one station or
+    one year never sit on both sides of a split.
+    """
+    def __init__(self, dataset, target, k=5, degree=2, by=None, features=None, seed=0, chunk_size=250000):
+        if k < 2:
+            raise ValueError("Cross-validation needs at least 2 folds.")
+        self.target = target
+        self.k = k
+        self.degree = degree
+        self.by = by
+        self.seed = seed
+        self.features = list(features) if features is not None else [c for c in dataset.columns if c not in (target, by)]
+        self._kernel = make_expansion(self.features, degree) if degree is not None and degree >= 2 else None
+        if self._kernel is not None:
+            self._kernel.fit(np.zeros((1, len(self.features))))
+            n_terms = self._kernel.n_output_features_
+        else:
+            n_terms = len(self.features)
+        self.folds = [SufficientStats(n_terms) for _ in range(k)]
+        self._accumulate(dataset, chunk_size)
+        self.total = SufficientStats(n_terms)
+        for stats in self.folds:
+            self.total += stats
+
+    def _accumulate(self, dataset, chunk_size):
+        columns = self.features + [self.target] + ([self.by] if self.by is not None and self.by not in self.features else [])
+        rng = np.random.default_rng(self.seed)
+        with stage("Accumulating fold statistics", folds=self.k, by=self.by) as span:
+            for chunk in dataset.iter_chunks(chunk_size, columns):
+                X = chunk.loc[:, self.features].to_numpy(dtype=np.float64)
+                y = chunk[self.target].to_numpy(dtype=np.float64)
+                if self.by is None:
+                    folds = rng.integers(0, self.k, len(chunk))
+                else:
+                    folds = fold_ids(chunk[self.by].to_numpy(), self.k, self.seed)
+                # one sort per chunk turns every fold into a contiguous slice
+                order = np.argsort(folds, kind='stable')
+                bounds = np.searchsorted(folds[order], np.arange(self.k + 1))
+                X, y = X[order], y[order]
+                for i in range(self.k):
+                    if bounds[i + 1] > bounds[i]:
+                        accumulate(self.folds[i], self._kernel, X[bounds[i]:bounds[i + 1]], y[bounds[i]:bounds[i + 1]])
+                span.add(rows=len(chunk))
+
+    def fold(self, i, ridge=0.0):
+        """(coef, intercept) of the model trained without fold i."""
+        return (self.total - self.folds[i]).solve(ridge=ridge)
+
+    def run(self, ridge=0.0):
+        """Train and held-out metrics of every fold, one row per fold, with
+        the mean and standard deviation over folds in the last two rows."""
+        results = []
+        for i, held_out in enumerate(self.folds):
+            if held_out.rows == 0:
+                continue
+            training = self.total - held_out
+            coef, intercept = training.solve(ridge=ridge)
+            result = {'fold': i, 'train rows': training.rows, 'held-out rows': held_out.rows}
+            for name, value in training.score(coef, intercept).items():
+                result['train ' + name] = value
+            for name, value in held_out.score(coef, intercept).items():
+                result['held-out ' + name] = value
+            results.append(result)
+        table = pd.DataFrame(results).set_index('fold')
+        summary = table.agg(['mean', 'std'])
+        return pd.concat([table, summary])
+
+    def model(self, ridge=0.0):
+        """A Model fitted on every fold."""
+        coef, intercept = self.total.solve(ridge=ridge)
+        model = Model()
+        model.restore(self.target, self.features, self.degree, coef, intercept)
+        return model
+
+def cross_validate(dataset, target, k=5, degree=2, by=None, ridge=0.0, seed=0, chunk_size=250000):
+    return CrossValidation(dataset, target, k, degree, by, seed=seed, chunk_size=chunk_size).run(ridge)
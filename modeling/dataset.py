@@ -1,49 +1,180 @@
+import glob
+import os
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 from google import auth
 from google.cloud import bigquery,bigquery_storage_v1beta1
-import time
+from concurrent.futures import ThreadPoolExecutor
+from .filters import Filter
+from .sampling import Downsample
+from .instrument import stage
+from . import schema
 
 class Dataset():
-    def __init__(self, table_name='train',columns=None, max_size=None, data_where=None):
+    def __init__(self, table_name='train',columns=None, max_size=None, data_where=None, source=None, cache=None, streams=1, workers=None, storage_client=None, shards=None, loader=None, store=None, compact=False, pack_flags=False, downsample=None):
         self._data = None
         self._table_name = table_name
-        self._data_where = None
-        if columns is not None:
+        # Filters are pushed into every read; callables are still evaluated
+        # row by row once the data is local.
+        self._data_where = Filter.coerce(data_where)
+        self._source = source
+        self._cache = cache
+        self._streams = streams
+        self._workers = workers
+        self._storage_client = storage_client
+        self._shards = None
+        self._arrays = {}
+        self._arrays_owner = None
+        self._loader = loader
+        self._store = store
+        # Compact frames hold flags and month as uint8 and measurements as
+        # float32; packed flags go one step further and keep the flag
+        # columns as a bit block outside the frame.
+        self._compact = compact or pack_flags
+        self._pack_flags = pack_flags
+        self._flags = None
+        # Downsampled datasets keep a per-row importance weight, 1/rate of
+        # the row's class, alongside the frame.
+        self._downsample = Downsample.coerce(downsample)
+        self._weights = None
+        if shards is not None:
+            # Shard-backed datasets stay on disk and are read with iter_chunks.
+            self._shards = sorted(glob.glob(os.path.join(shards, '*.parquet'))) if isinstance(shards, str) else list(shards)
+            if len(self._shards) == 0:
+                raise FileNotFoundError("No parquet shards found in {}".format(shards))
+            self._columns = list(columns) if columns is not None else pq.read_schema(self._shards[0]).names
+        elif loader is not None:
+            # Lazily loaded datasets (e.g. memory-mapped model artifacts) are
+            # only read when their frame is first used.
+            self._columns = list(columns) if columns is not None else None
+        elif columns is not None:
             self._columns = list(columns)
-            if max_size is None:
-                self.load_new_data()
-            else:
-                self.load_new_data_partial(max_rows=max_size)
+            self.load(max_size)
         else:
             self._columns = None
 
     def __del__(self):
         del self._data
 
+    def load(self, max_rows=None):
+        # store partitions are already local shards, so they bypass the cache
+        if self._cache is not None and self._store is None:
+            with stage("Loading dataframe from cache") as span:
+                data = self._cache.get(self._table_name, self._columns, max_rows, self._cache_where(), self._cache_source())
+                span.add(hit=data is not None)
+                if data is not None:
+                    span.add(rows=len(data), bytes=_frame_bytes(data))
+            if data is not None:
+                self._data = schema.compact(data) if self._compact else data.astype(schema.load_dtypes(data.columns))
+                self._finish_load()
+                return
+        if self._store is not None:
+            self.load_from_store(max_rows)
+        elif self._source is not None:
+            self.load_from_source(max_rows)
+        elif max_rows is None:
+            self.load_new_data()
+        else:
+            self.load_new_data_partial(max_rows=max_rows)
+        if self._compact:
+            self._data = schema.compact(self._data)
+        if self._cache is not None and self._store is None:
+            self._cache.put(self._table_name, self._columns, max_rows, self._cache_where(), self._data, self._cache_source())
+        self._finish_load()
+
+    def _cache_where(self):
+        # sampled and compact frames are cached under their own keys, so a
+        # full-precision load never reads back rounded float32 values
+        where = self._data_where
+        if callable(where):
+            return where
+        if self._downsample is not None:
+            where = (where, self._downsample)
+        if self._compact:
+            where = (where, 'compact')
+        return where
+
+    def _cache_source(self):
+        # rows from different sources never share a cache entry
+        if self._source is not None:
+            return self._source
+        # a stand-in storage client names its own source; a real one reads
+        # the default BigQuery dataset
+        return self._storage_client if hasattr(self._storage_client, 'identity') else None
+
+    def _finish_load(self):
+        if self._downsample is not None:
+            self._weights = self._downsample.weights(self._data)
+        if self._pack_flags:
+            flags = [c for c in self._data.columns if c in schema.FLAG_COLUMNS]
+            if flags:
+                self._flags = schema.PackedFlags(self._data, flags)
+                self._data = self._data.drop(columns=flags)
+
+    def load_from_source(self, max_rows=None):
+        dtypes = schema.load_dtypes(self._columns, self._compact)
+        with stage("Generating dataframe") as span:
+            self._data = self._sample(self._source.fetch(self._table_name, self._columns, max_rows, where=self.filter)).astype(dtypes)
+            span.add(rows=len(self._data), bytes=_frame_bytes(self._data))
+        self._drop_missing()
+
+    def load_from_store(self, max_rows=None):
+        paths = self._store.paths(self.filter)
+        expression = self.filter.to_arrow() if self.filter is not None else None
+        dtypes = schema.load_dtypes(self._columns, self._compact)
+        with stage("Generating dataframe", partitions=len(paths), total_partitions=len(self._store.partitions())) as span:
+            frames = []
+            rows = 0
+            for key, path in enumerate(paths):
+                if max_rows is not None and rows >= max_rows:
+                    break
+                frame = self._sample(self._where(pq.read_table(path, columns=self._columns, filters=expression).to_pandas()), key).astype(dtypes).dropna()
+                frames.append(frame)
+                rows += len(frame)
+            if len(frames) == 0:
+                self._data = pd.DataFrame(columns=self._columns).astype(dtypes)
+            else:
+                self._data = pd.concat(frames, ignore_index=True, copy=False)
+            if max_rows is not None:
+                self._data = self._data.iloc[:max_rows]
+            span.add(rows=len(self._data), bytes=_frame_bytes(self._data))
+
+    def _drop_missing(self):
+        with stage("Removing n/a values", rows=len(self._data)) as span:
+            self._data = self._where(self._data).dropna()
+            span.add(kept=len(self._data))
+
+    def _where(self, data):
+        if not callable(self._data_where):
+            return data
+        return data.loc[data.apply(self._data_where, axis=1).to_numpy(dtype=bool),:]
+
     def load_new_data_partial(self,max_rows):
         client = bigquery.Client()
-        dtypes = dict([(c, 'float64') for c in self._columns])
+        dtypes = schema.load_dtypes(self._columns, self._compact)
         table_ref = bigquery.table.TableReference.from_string('to-hail-or-not-to-hail.gsod_copy.{}'.format(self._table_name))
-        table = client.get_table(table_ref)
-        schema_subset = [col for col in table.schema if col.name in self._columns]
-        rows = client.list_rows(table, selected_fields=schema_subset,max_results=max_rows)
-        print("    --> Generating dataframe...")
-        start = time.perf_counter()
-        self._data = rows.to_dataframe(dtypes=dtypes)
-        cost = time.perf_counter() - start
-        print("    --> Generated dataframe ({} s).".format(cost))
-        if self._data_where is not None:
-            self._data = self._data.loc[self._data.index.map(self._data_where),:].dropna()
-        else:
-            start = time.perf_counter()
-            self._data = self._data.dropna()
-            cost = time.perf_counter() - start
-            print("    --> Removed n/a values ({} s).".format(cost))
+        with stage("Generating dataframe") as span:
+            if self.filter is not None:
+                # list_rows cannot filter, so the predicate goes into a query
+                query = 'SELECT {} FROM `{}.{}.{}` WHERE {} LIMIT {}'.format(', '.join(self._columns), table_ref.project,
+                    table_ref.dataset_id, table_ref.table_id, self.filter.to_sql(), int(max_rows))
+                self._data = client.query(query).to_dataframe().astype(dtypes)
+            else:
+                table = client.get_table(table_ref)
+                schema_subset = [col for col in table.schema if col.name in self._columns]
+                rows = client.list_rows(table, selected_fields=schema_subset,max_results=max_rows)
+                self._data = rows.to_dataframe(dtypes=dtypes)
+            self._data = self._sample(self._data)
+            span.add(rows=len(self._data), bytes=_frame_bytes(self._data))
+        self._drop_missing()
 
     def load_new_data(self):
-        storage_client = bigquery_storage_v1beta1.BigQueryStorageClient()
-        
-        client = bigquery.Client()
+        storage_client = self._storage_client
+        if storage_client is None:
+            storage_client = bigquery_storage_v1beta1.BigQueryStorageClient()
 
         table_reference = bigquery_storage_v1beta1.types.TableReference(
             project_id= 'to-hail-or-not-to-hail',
@@ -53,30 +184,196 @@ class Dataset():
         parent = 'projects/to-hail-or-not-to-hail'
         read_options = bigquery_storage_v1beta1.types.TableReadOptions()
         read_options.selected_fields.extend(self._columns)
-        session = storage_client.create_read_session(table_reference, parent, read_options=read_options)
+        if self.filter is not None:
+            read_options.row_restriction = self.filter.to_sql()
+        session = storage_client.create_read_session(table_reference, parent, read_options=read_options,
+            requested_streams=self._streams, format_=bigquery_storage_v1beta1.enums.DataFormat.ARROW)
+        dtypes = schema.load_dtypes(self._columns, self._compact)
+        with stage("Generating dataframe", streams=len(session.streams)) as span:
+            # Arrow decoding releases the GIL, so one thread per stream keeps
+            # every core busy without pickling the client into subprocesses.
+            workers = self._workers or len(session.streams) or 1
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                frames = list(pool.map(lambda item: self._read_stream(storage_client, session, item[1], dtypes, item[0]), enumerate(session.streams)))
+            if len(frames) == 0:
+                self._data = pd.DataFrame(columns=self._columns).astype(dtypes)
+            elif len(frames) == 1:
+                self._data = frames[0]
+            else:
+                self._data = pd.concat(frames, ignore_index=True, copy=False)
+            span.add(rows=len(self._data), bytes=_frame_bytes(self._data))
+        self._drop_missing()
+
+    def _read_stream(self, storage_client, session, stream, dtypes, key=0):
         reader = storage_client.read_rows(
-            bigquery_storage_v1beta1.types.StreamPosition(stream=session.streams[0])
+            bigquery_storage_v1beta1.types.StreamPosition(stream=stream)
         )
-        dtypes = dict([(c, 'float64') for c in self._columns])
-        print("  --> Generating dataframe...")
-        start = time.perf_counter()
-        self._data = reader.to_dataframe(session,dtypes=dtypes)
-        cost = time.perf_counter() - start
-        print("  --> Generated dataframe ({} s).".format(cost))
-        if self._data_where is not None:
-            self._data = self._data.loc[self._data.index.map(self._data_where),:].dropna()
-        else:
-            start = time.perf_counter()
-            self._data = self._data.dropna()
-            cost = time.perf_counter() - start
-            print("  --> Removed n/a values ({} s).".format(cost))
+        # each stream is sampled as it arrives, so a full-table read never
+        # holds more than one stream's unsampled rows
+        return self._sample(reader.to_dataframe(session,dtypes=dtypes), key)
+
+    def _sample(self, data, key=0):
+        if self._downsample is None:
+            return data
+        return self._downsample.apply(data, key)
+
+    def array(self, columns, dtype='float64'):
+        # Numeric blocks are built once per frame and reused; assigning a new
+        # frame to _data drops them. dtype=None keeps the columns' common
+        # type, so compact frames are not widened to float64 here.
+        if self.data is None:
+            return None
+        if self._arrays_owner is not self._data:
+            self._arrays = {}
+            self._arrays_owner = self._data
+        if dtype is None:
+            dtype = np.result_type(*[self._column_dtype(c) for c in columns])
+        key = (tuple(columns), np.dtype(dtype).str)
+        if key not in self._arrays:
+            if self._flags is not None and any(c in self._flags for c in columns):
+                block = np.empty((len(self._data), len(columns)), dtype=dtype)
+                for i, c in enumerate(columns):
+                    block[:, i] = self._flags.column(c) if c in self._flags else self._data[c].to_numpy()
+            else:
+                block = np.ascontiguousarray(self._data.loc[:, list(columns)].to_numpy(dtype=dtype))
+            block.flags.writeable = False
+            self._arrays[key] = block
+        return self._arrays[key]
+
+    def iter_arrays(self, features, target, chunk_size=250000, dtype='float64', weights=False):
+        # With weights, chunks are (X, y, w): the importance weights of a
+        # downsampled dataset, or ones.
+        if self.data is not None:
+            X = self.array(features, dtype)
+            y = self.array(target, dtype)
+            w = self._weights if self._weights is not None else np.ones(len(X))
+            for start in range(0, len(X), chunk_size):
+                if weights:
+                    yield X[start:start+chunk_size], y[start:start+chunk_size], w[start:start+chunk_size]
+                else:
+                    yield X[start:start+chunk_size], y[start:start+chunk_size]
+            return
+        columns = list(features) + list(target)
+        if weights and self._downsample is not None and self._downsample.column not in columns:
+            columns.append(self._downsample.column)
+        for chunk in self.iter_chunks(chunk_size, columns):
+            X, y = chunk.loc[:, list(features)].to_numpy(dtype=dtype), chunk.loc[:, list(target)].to_numpy(dtype=dtype)
+            if weights:
+                yield X, y, self._downsample.weights(chunk) if self._downsample is not None else np.ones(len(chunk))
+            else:
+                yield X, y
+
+    def iter_chunks(self, chunk_size=250000, columns=None):
+        columns = list(columns) if columns is not None else list(self.columns)
+        if self.data is not None:
+            for start in range(0, len(self._data), chunk_size):
+                yield self.frame(columns, start, start+chunk_size)
+            return
+        if self._shards is None:
+            return
+        expression = self.filter.to_arrow() if self.filter is not None else None
+        read = list(columns)
+        if self._downsample is not None and self._downsample.column not in read:
+            read.append(self._downsample.column)
+        dtypes = schema.load_dtypes(read, self._compact)
+        pending = []
+        pending_rows = 0
+        key = 0
+        for path in self._shards:
+            if expression is None:
+                batches = pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=read)
+            else:
+                batches = ds.dataset(path, format='parquet').to_batches(columns=read, filter=expression, batch_size=chunk_size)
+            for batch in batches:
+                pending.append(batch)
+                pending_rows += batch.num_rows
+                while pending_rows >= chunk_size:
+                    table = pa.Table.from_batches(pending)
+                    yield self._chunk(table.slice(0, chunk_size), dtypes, columns, key)
+                    key += 1
+                    table = table.slice(chunk_size)
+                    pending = table.to_batches()
+                    pending_rows = table.num_rows
+        if pending_rows:
+            yield self._chunk(pa.Table.from_batches(pending), dtypes, columns, key)
+
+    def _chunk(self, table, dtypes, columns, key):
+        data = self._sample(self._where(table.to_pandas()), key).astype(dtypes).dropna()
+        if len(data.columns) != len(columns):
+            data = data.loc[:, columns]
+        return schema.compact(data) if self._compact else data
+
+    def _column_dtype(self, column):
+        if self._flags is not None and column in self._flags:
+            return np.dtype('uint8')
+        return self._data[column].dtype
+
+    def frame(self, columns=None, start=None, stop=None):
+        """The loaded rows as one DataFrame, with packed flags unpacked."""
+        if self.data is None:
+            return None
+        columns = list(columns) if columns is not None else list(self.columns)
+        if self._flags is None or not any(c in self._flags for c in columns):
+            return self._data.iloc[start:stop].loc[:, columns]
+        data = self._data.iloc[start:stop]
+        return pd.DataFrame(dict((c, self._flags.column(c, start, stop) if c in self._flags else data[c].to_numpy()) for c in columns),
+                            index=data.index)
+
+    def write_shards(self, directory, rows_per_shard=1000000, compression='zstd'):
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for index, chunk in enumerate(self.iter_chunks(rows_per_shard)):
+            path = os.path.join(directory, '{}-{:05d}.parquet'.format(self._table_name, index))
+            pq.write_table(pa.Table.from_pandas(chunk, preserve_index=False), path, compression=compression)
+            paths.append(path)
+        return paths
+
+    @property
+    def streaming(self):
+        return self._data is None and self._loader is None and self._shards is not None
+
+    @property
+    def filter(self):
+        return self._data_where if isinstance(self._data_where, Filter) else None
+
+    @property
+    def shards(self):
+        return self._shards
 
     @property
     def columns(self):
         if self._columns is None and self._data is not None:
-            self._columns = list(self._data.columns)
+            self._columns = list(self._data.columns) + (self._flags.columns if self._flags is not None else [])
         return self._columns
 
+    @property
+    def weights(self):
+        """Per-row importance weights of a downsampled dataset, else None."""
+        return self._weights
+
+    @property
+    def downsample(self):
+        return self._downsample
+
+    @property
+    def nbytes(self):
+        if self._data is None:
+            return 0
+        return _frame_bytes(self._data) + (self._flags.nbytes if self._flags is not None else 0)
+
     @property
     def data(self):
+        if self._data is None and self._loader is not None:
+            self._data = self._loader()
+            self._loader = None
         return self._data
+
+    @data.setter
+    def data(self, data):
+        self._data = data
+        self._flags = None
+        self._weights = None
+        self._loader = None
+
+def _frame_bytes(data):
+    return int(data.memory_usage(index=False).sum())
@@ -0,0 +1,106 @@
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+class PolynomialEvaluator():
+    """Compiled form of a fitted polynomial regression.
+
+    The model is kept as a monomial exponent matrix plus coefficients and
+    evaluated directly, without building the PolynomialFeatures expansion:
+    the linear part is one matrix-vector product and each higher degree is
+    a sum over shared monomial prefixes, prefix * (X @ C), computed in
+    row chunks so no n x p intermediate is ever allocated.
+    """
+    def __init__(self, powers, coef, intercept=0.0, features=None):
+        powers = np.asarray(powers, dtype=np.int64)
+        coef = np.asarray(coef, dtype=np.float64).ravel()
+        degrees = powers.sum(axis=1)
+        self._features = list(features) if features is not None else None
+        self._n_features = powers.shape[1]
+        self._powers = powers.astype(np.int8)
+        self._coef = coef
+        self._intercept = float(intercept) + coef[degrees == 0].sum()
+        self._linear = np.zeros(self._n_features)
+        # Higher-degree terms grouped by degree: the prefixes (all but the
+        # last variable of each monomial) and the coefficient rows that
+        # multiply X for each prefix.
+        self._levels = []
+        levels = {}
+        for exponents, c in zip(powers, coef):
+            if c == 0 or exponents.sum() == 0:
+                continue
+            term = tuple(np.repeat(np.arange(self._n_features), exponents))
+            if len(term) == 1:
+                self._linear[term[0]] += c
+            else:
+                levels.setdefault(len(term), {}).setdefault(term[:-1], np.zeros(self._n_features))[term[-1]] += c
+        for degree in sorted(levels):
+            prefixes = sorted(levels[degree])
+            self._levels.append((prefixes, np.array([levels[degree][p] for p in prefixes]).T))
+
+    @classmethod
+    def from_pipeline(cls, pipeline, features=None):
+        regression = pipeline.named_steps['regression']
+        coef = np.asarray(regression.coef_, dtype=np.float64).ravel()
+        intercept = np.asarray(regression.intercept_, dtype=np.float64).ravel()[0]
+        kernel = pipeline.named_steps.get('kernel')
+        if kernel is not None:
+            powers = kernel.powers_
+        else:
+            powers = np.eye(len(coef), dtype=np.int64)
+        return cls(powers, coef, intercept, features=features)
+
+    def predict(self, X, chunk_size=65536, n_jobs=1):
+        # compact inputs stay as they are; each chunk is widened on its own
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if X.shape[1] != self._n_features:
+            raise ValueError("Expected {} features, got {}.".format(self._n_features, X.shape[1]))
+        out = np.empty(X.shape[0])
+        bounds = [(start, min(start + chunk_size, X.shape[0])) for start in range(0, X.shape[0], chunk_size)]
+        if n_jobs is not None and n_jobs > 1 and len(bounds) > 1:
+            # The chunk work is BLAS and ufunc calls that release the GIL.
+            with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+                list(pool.map(lambda b: self._predict_chunk(X[b[0]:b[1]], out[b[0]:b[1]]), bounds))
+        else:
+            for start, stop in bounds:
+                self._predict_chunk(X[start:stop], out[start:stop])
+        return out
+
+    def _predict_chunk(self, X, out):
+        X = np.asarray(X, dtype=np.float64)
+        out[:] = X @ self._linear
+        out += self._intercept
+        products = {}
+        for prefixes, coef in self._levels:
+            V = np.empty((X.shape[0], len(prefixes)))
+            for i, prefix in enumerate(prefixes):
+                V[:, i] = self._product(X, prefix, products)
+            out += np.einsum('ij,ij->i', V, X @ coef)
+
+    def _product(self, X, prefix, products):
+        if len(prefix) == 1:
+            return X[:, prefix[0]]
+        if prefix not in products:
+            products[prefix] = self._product(X, prefix[:-1], products) * X[:, prefix[-1]]
+        return products[prefix]
+
+    @property
+    def powers(self):
+        return self._powers
+
+    @property
+    def coef(self):
+        return self._coef
+
+    @property
+    def intercept(self):
+        return self._intercept
+
+    @property
+    def features(self):
+        return self._features
+
+    @property
+    def degree(self):
+        return int(self._powers.sum(axis=1).max()) if len(self._powers) else 0
@@ -0,0 +1,199 @@
+import itertools
+import numpy as np
+from sklearn.base import BaseEstimator, TransformerMixin
+from . import schema
+from .parallel import map_shared
+from .stats import SufficientStats
+
+# Per-process state of accumulate_ranges tasks: the [X | y] block and the
+# kernel, set by _init_ranges in the parent or in each pool process.
+_ranges = {}
+
+class PolynomialExpansion(TransformerMixin, BaseEstimator):
+    """PolynomialFeatures for data with 0/1 flag columns.
+
+    A flag raised to any power equals the flag, so those powers are never
+    generated (fog^2, hail^2, fog hail^2, ...); the remaining terms keep
+    PolynomialFeatures' order, powers_ and feature names. Every term that
+    contains a flag is zero wherever the flag is, so moments() builds a
+    chunk's Gram statistics with such terms evaluated only on the rows
+    where all of their flags are set.
+    """
+    def __init__(self, degree=2, binary=(), include_bias=True, powers=None, max_density=0.1):
+        self.degree = degree
+        self.binary = binary
+        self.include_bias = include_bias
+        self.powers = powers
+        self.max_density = max_density
+
+    def fit(self, X, y=None):
+        n_features = np.asarray(X).shape[1]
+        binary = sorted(set(self.binary))
+        if self.powers is not None:
+            powers = np.asarray(self.powers, dtype=np.int64).reshape(-1, n_features)
+        else:
+            rows = [np.zeros(n_features, dtype=np.int64)] if self.include_bias else []
+            for degree in range(1, self.degree + 1):
+                for term in itertools.combinations_with_replacement(range(n_features), degree):
+                    exponents = np.bincount(term, minlength=n_features)
+                    if binary and exponents[binary].max() > 1:
+                        continue
+                    rows.append(exponents)
+            powers = np.array(rows, dtype=np.int64).reshape(-1, n_features)
+        self.powers_ = powers
+        self.n_features_in_ = n_features
+        self.n_output_features_ = len(powers)
+        # Terms grouped by the set of flags they contain; the rest of each
+        # term (its exponents on the non-flag columns) is evaluated densely.
+        flags = np.zeros(n_features, dtype=bool)
+        flags[binary] = True
+        self._dense_powers = np.where(flags, 0, powers)
+        groups = {}
+        for j, exponents in enumerate(powers):
+            groups.setdefault(tuple(np.flatnonzero(flags & (exponents > 0))), []).append(j)
+        self._dense = np.array(groups.pop((), []), dtype=np.int64)
+        self._groups = [(np.array(key), np.array(terms, dtype=np.int64)) for key, terms in sorted(groups.items())]
+        return self
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        out = np.empty((X.shape[0], self.n_output_features_), order='F')
+        products = {}
+        for j, exponents in enumerate(self.powers_):
+            out[:, j] = _monomial(X, exponents, products)
+        return out
+
+    def moments(self, X, y):
+        """(rows, weight, mean, comoment) of [terms, y] for one chunk, as
+        SufficientStats.update_moments takes them.
+
+        Non-flag terms and y form a dense block that is centered and
+        multiplied as usual. A flag group's terms are formed only on the
+        rows where its flags are all set; their products with the centered
+        dense block are taken over those rows alone, and products between
+        two groups over the rows where both groups' flags are set.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64).ravel()
+        rows = X.shape[0]
+        n_terms = self.n_output_features_
+        mean = np.zeros(n_terms + 1)
+        comoment = np.zeros((n_terms + 1, n_terms + 1))
+        if rows == 0:
+            return 0, 0.0, mean, comoment
+        # Groups whose flags are set on more than max_density of the rows
+        # gain little from skipping zeros and join the dense block.
+        set_rows = {}
+        sparse_groups = []
+        dense = [self._dense]
+        for flags, terms in self._groups:
+            selected = _rows_where(X, flags, set_rows)
+            if len(selected) > self.max_density * rows:
+                dense.append(terms)
+            else:
+                sparse_groups.append((flags, terms, selected))
+        dense = np.append(np.concatenate(dense), n_terms)
+        products = {}
+        D = np.empty((rows, len(dense)), order='F')
+        for i, j in enumerate(dense[:-1]):
+            D[:, i] = _monomial(X, self.powers_[j], products)
+        D[:, -1] = y
+        mean[dense] = D.mean(axis=0)
+        D -= mean[dense]
+        comoment[np.ix_(dense, dense)] = D.T @ D
+
+        blocks = []
+        for flags, terms, selected in sparse_groups:
+            subset = X[selected]
+            subset_products = {}
+            values = np.empty((len(selected), len(terms)), order='F')
+            for i, j in enumerate(terms):
+                values[:, i] = _monomial(subset, self._dense_powers[j], subset_products)
+            mean[terms] = values.sum(axis=0) / rows
+            # the centered dense columns sum to zero, so the flag term means
+            # drop out of these cross products
+            cross = values.T @ D[selected]
+            comoment[np.ix_(terms, dense)] = cross
+            comoment[np.ix_(dense, terms)] = cross.T
+            blocks.append((flags, terms, selected, values))
+        for (a_flags, a_terms, a_rows, a_values), (b_flags, b_terms, b_rows, b_values) in \
+                itertools.combinations_with_replacement(blocks, 2):
+            if a_rows is b_rows:
+                shared = a_values.T @ b_values
+            else:
+                both = _rows_where(X, np.union1d(a_flags, b_flags), set_rows)
+                if len(both) == 0:
+                    shared = 0.0
+                else:
+                    shared = a_values[np.searchsorted(a_rows, both)].T @ b_values[np.searchsorted(b_rows, both)]
+            block = shared - rows * np.outer(mean[a_terms], mean[b_terms])
+            comoment[np.ix_(a_terms, b_terms)] = block
+            comoment[np.ix_(b_terms, a_terms)] = block.T
+        return rows, float(rows), mean, comoment
+
+    def get_feature_names_out(self, input_features=None):
+        if input_features is None:
+            input_features = ['x{}'.format(i) for i in range(self.n_features_in_)]
+        names = []
+        for exponents in self.powers_:
+            parts = [name if e == 1 else '{}^{}'.format(name, e) for name, e in zip(input_features, exponents) if e > 0]
+            names.append(' '.join(parts) if parts else '1')
+        return np.array(names, dtype=object)
+
+def _monomial(X, exponents, products):
+    # product of columns, reusing the product of all but the last factor
+    term = tuple(np.repeat(np.arange(len(exponents)), exponents))
+    if len(term) == 0:
+        return np.ones(X.shape[0])
+    if term not in products:
+        if len(term) == 1:
+            products[term] = X[:, term[0]]
+        else:
+            products[term] = _monomial(X, np.bincount(term[:-1], minlength=len(exponents)), products) * X[:, term[-1]]
+    return products[term]
+
+def _rows_where(X, flags, cache):
+    key = tuple(int(f) for f in flags)
+    if key not in cache:
+        if len(key) == 1:
+            cache[key] = np.flatnonzero(X[:, key[0]] != 0)
+        else:
+            cache[key] = np.intersect1d(_rows_where(X, key[:-1], cache), _rows_where(X, key[-1:], cache), assume_unique=True)
+    return cache[key]
+
+def make_expansion(features, degree, include_bias=True, powers=None):
+    """Expansion of features with the GSOD flag columns marked binary."""
+    return PolynomialExpansion(degree=degree, binary=[i for i, f in enumerate(features) if f in schema.FLAG_COLUMNS],
+                               include_bias=include_bias, powers=powers)
+
+def accumulate(stats, kernel, X, y):
+    """Folds one chunk into stats, through the kernel's sparse moments when
+    it has them and a dense expansion otherwise."""
+    if kernel is None:
+        stats.update(X, y)
+    elif hasattr(kernel, 'moments'):
+        stats.update_moments(*kernel.moments(X, y))
+    else:
+        stats.update(kernel.transform(np.asarray(X, dtype=np.float64)), y)
+    return stats
+
+def _init_ranges(data, kernel):
+    _ranges.update(data=data, kernel=kernel)
+
+def _accumulate_range(bounds):
+    start, stop, chunk_size = bounds
+    data, kernel = _ranges['data'], _ranges['kernel']
+    stats = SufficientStats(kernel.n_output_features_)
+    for begin in range(start, stop, chunk_size):
+        chunk = data[begin:min(begin + chunk_size, stop)]
+        accumulate(stats, kernel, chunk[:, :-1], chunk[:, -1])
+    return stats
+
+def accumulate_ranges(data, kernel, ranges, workers=1, order=None):
+    """SufficientStats of each (start, stop, chunk_size) row range of an
+    [X | y] block (its rows taken in order, when given), expanded chunk by
+    chunk across a pool of workers sharing the block."""
+    try:
+        return map_shared(_accumulate_range, ranges, data, _init_ranges, (kernel,), workers, order)
+    finally:
+        _ranges.clear()
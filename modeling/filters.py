@@ -0,0 +1,126 @@
+import ast
+import re
+import numpy as np
+import pyarrow.compute as pc
+
+OPERATORS = {
+    '==': lambda v, x: v == x,
+    '!=': lambda v, x: v != x,
+    '<': lambda v, x: v < x,
+    '<=': lambda v, x: v <= x,
+    '>': lambda v, x: v > x,
+    '>=': lambda v, x: v >= x,
+    'in': lambda v, x: np.isin(v, list(x)),
+}
+SQL_OPERATORS = {'==': '=', '!=': '!=', '<': '<', '<=': '<=', '>': '>', '>=': '>=', 'in': 'IN'}
+_SQL_TERM = re.compile(r"\s*(\w+) (=|!=|<=|>=|<|>|IN) (\([^)]*\)|'(?:[^'\\]|\\.)*'|[^\s]+)\s*(?:AND|$)")
+
+class Filter():
+    """Conjunction of (column, op, value) terms, e.g.
+    Filter(('mo', 'in', [6, 7, 8]), ('latitude', '>=', 30)).
+
+    The same expression is rendered as a SQL predicate for BigQuery (the
+    storage API row_restriction or a query's WHERE clause), as a pyarrow
+    expression for Parquet reads, as a vectorized mask over a DataFrame,
+    and is checked against partition min/max stats for pruning.
+    """
+    def __init__(self, *terms):
+        self._terms = []
+        for column, op, value in terms:
+            if op not in OPERATORS:
+                raise ValueError("Unsupported filter operator '{}'.".format(op))
+            self._terms.append((column, op, tuple(value) if op == 'in' else value))
+
+    @classmethod
+    def coerce(cls, where):
+        """Filter for data_where: Filters and callables pass through, a
+        single triple or a list of triples becomes a Filter."""
+        if where is None or isinstance(where, cls) or callable(where):
+            return where
+        if len(where) == 3 and isinstance(where[0], str) and where[1] in OPERATORS:
+            return cls(where)
+        return cls(*where)
+
+    @classmethod
+    def from_sql(cls, sql):
+        """Inverse of to_sql, for predicates this class produced."""
+        operators = dict((v, k) for k, v in SQL_OPERATORS.items())
+        terms = []
+        position = 0
+        while position < len(sql):
+            match = _SQL_TERM.match(sql, position)
+            if match is None:
+                raise ValueError("Cannot parse filter predicate '{}'.".format(sql))
+            column, op, literal = match.groups()
+            value = ast.literal_eval(re.sub(r'\b(TRUE|FALSE)\b', lambda m: m.group(1).title(), literal))
+            if op == 'IN' and not isinstance(value, tuple):
+                value = (value,)
+            terms.append((column, operators[op], value))
+            position = match.end()
+        return cls(*terms)
+
+    def to_sql(self):
+        return ' AND '.join('{} {} {}'.format(column, SQL_OPERATORS[op], _sql_literal(value)) for column, op, value in self._terms)
+
+    def to_arrow(self):
+        expression = None
+        for column, op, value in self._terms:
+            term = pc.field(column).isin(list(value)) if op == 'in' else OPERATORS[op](pc.field(column), value)
+            expression = term if expression is None else expression & term
+        return expression
+
+    def mask(self, data):
+        mask = np.ones(len(data), dtype=bool)
+        for column, op, value in self._terms:
+            mask &= np.asarray(OPERATORS[op](data[column].to_numpy(), value), dtype=bool)
+        return mask
+
+    def may_match(self, stats):
+        """False only if the [min, max] stats prove no row can match;
+        columns without stats never prune."""
+        for column, op, value in self._terms:
+            if column not in stats:
+                continue
+            low, high = stats[column]
+            if low is None:
+                return False
+            if op == '==' and not low <= value <= high:
+                return False
+            if op == '!=' and low == high == value:
+                return False
+            if op == '<' and not low < value:
+                return False
+            if op == '<=' and not low <= value:
+                return False
+            if op == '>' and not high > value:
+                return False
+            if op == '>=' and not high >= value:
+                return False
+            if op == 'in' and not any(low <= v <= high for v in value):
+                return False
+        return True
+
+    def __and__(self, other):
+        return Filter(*(self._terms + list(Filter.coerce(other))))
+
+    def __iter__(self):
+        return iter(self._terms)
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __repr__(self):
+        return 'Filter({})'.format(', '.join(repr(term) for term in self._terms))
+
+    @property
+    def columns(self):
+        return list(dict.fromkeys(column for column, _, _ in self._terms))
+
+def _sql_literal(value):
+    if isinstance(value, tuple):
+        return '({})'.format(', '.join(_sql_literal(v) for v in value))
+    if isinstance(value, str):
+        return "'{}'".format(value.replace("\\", "\\\\").replace("'", "\\'"))
+    if isinstance(value, (bool, np.bool_)):
+        return 'TRUE' if value else 'FALSE'
+    return repr(value.item() if isinstance(value, np.generic) else value)
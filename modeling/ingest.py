@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from google.api_core.exceptions import NotFound
+from google.cloud import bigquery
+from .filters import Filter
+from .cache import read_manifest, write_manifest
+from .schema import MISSING_VALUES
+from .instrument import stage
+
+GSOD_FIRST_YEAR = 1929
+GSOD_TABLE = 'bigquery-public-data.noaa_gsod.gsod{}'
+STATIONS_TABLE = 'bigquery-public-data.noaa_gsod.stations'
+# station metadata joined onto each reading, under the names the models use
+STATION_COLUMNS = {'latitude': 'lat', 'longitude': 'lon', 'altitude': 'elev'}
+ID_COLUMNS = ('stn', 'wban')
+DEFAULT_COLUMNS = ('stn', 'year', 'mo', 'da', 'temp', 'dewp', 'slp', 'stp', 'visib', 'wdsp', 'prcp',
+                   'fog', 'rain_drizzle', 'snow_ice_pellets', 'hail', 'thunder', 'tornado_funnel_cloud',
+                   'latitude', 'longitude', 'altitude')
+
+def partition_query(year, columns=DEFAULT_COLUMNS):
+    """Standard SQL for one year: only the requested columns, sentinels
+    turned into NULLs and numeric strings cast, with station coordinates
+    joined in when any are requested."""
+    fields = []
+    for c in columns:
+        if c in STATION_COLUMNS:
+            fields.append('SAFE_CAST(s.{} AS FLOAT64) AS {}'.format(STATION_COLUMNS[c], c))
+        elif c in ID_COLUMNS:
+            fields.append('g.{0} AS {0}'.format(c))
+        elif c in MISSING_VALUES:
+            fields.append('SAFE_CAST(NULLIF(g.{0}, {1}) AS FLOAT64) AS {0}'.format(c, MISSING_VALUES[c]))
+        else:
+            fields.append('SAFE_CAST(g.{0} AS FLOAT64) AS {0}'.format(c))
+    query = 'SELECT {} FROM `{}` g'.format(', '.join(fields), GSOD_TABLE.format(year))
+    if any(c in STATION_COLUMNS for c in columns):
+        query += ' JOIN `{}` s ON g.stn = s.usaf AND g.wban = s.wban'.format(STATIONS_TABLE)
+    return query
+
+def clean_partition(data, columns=DEFAULT_COLUMNS):
+    # local equivalent of partition_query for frames read from files
+    data = data.loc[:, [c for c in columns if c in data.columns]]
+    for c in data.columns:
+        if c in ID_COLUMNS:
+            continue
+        values = pd.to_numeric(data[c], errors='coerce').astype('float64')
+        if c in MISSING_VALUES:
+            values = values.mask(values == MISSING_VALUES[c])
+        data[c] = values
+    return data
+
+class PartitionedStore():
+    """Local GSOD store with one Parquet shard per year (or year and month).
+
+    Each partition is fetched with its own narrow query, written as a
+    compressed shard and recorded in a JSON manifest with its row count and
+    per-column min/max, which lets readers skip partitions that cannot match
+    a filter and lets refresh() pull only the years not yet stored.
+    """
+    manifest_name = 'manifest.json'
+
+    def __init__(self, directory=os.path.dirname(os.path.abspath(__file__))+'/store/', columns=DEFAULT_COLUMNS, by_month=False, source=None, client=None, compression='zstd'):
+        self.directory = directory
+        self.by_month = by_month
+        self.source = source
+        self.compression = compression
+        self._client = client
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._manifest = self._read_manifest()
+        if self._manifest.get('columns') is None:
+            self._manifest.update({'columns': list(columns), 'by_month': by_month, 'partitions': {}})
+        self.by_month = self._manifest['by_month']
+
+    def fetch_year(self, year):
+        try:
+            if self.source is not None:
+                return clean_partition(self.source.fetch('gsod{}'.format(year), None), self.columns)
+            client = self._client or bigquery.Client()
+            return client.query(partition_query(year, self.columns)).to_dataframe()
+        except (FileNotFoundError, NotFound):
+            return None
+
+    def ingest_year(self, year):
+        with stage("Ingesting {}".format(year), year=year) as span:
+            data = self.fetch_year(year)
+            if data is None:
+                print("    --> No GSOD table for {}.".format(year))
+                span.add(partitions=0)
+                return {}
+            if self.by_month:
+                parts = [('{}-{:02d}'.format(year, int(mo)), part) for mo, part in data.groupby('mo')]
+            else:
+                parts = [(str(year), data)]
+            entries = dict((key, self._write_partition(key, part)) for key, part in parts)
+            with self._lock:
+                partitions = self._manifest['partitions']
+                for key in [k for k, e in partitions.items() if e['year'] == year and k not in entries]:
+                    self._remove(partitions.pop(key))
+                partitions.update(entries)
+                self._write_manifest()
+            span.add(rows=len(data), partitions=len(entries))
+        return entries
+
+    def refresh(self, years=None, last_year=None, workers=4):
+        """Ingest the given years, or every GSOD year not stored yet; the
+        newest stored year is always re-pulled since it may have been
+        partial when it was fetched."""
+        if years is None:
+            stored = self.years
+            last_year = last_year or int(time.strftime('%Y'))
+            years = [y for y in range(GSOD_FIRST_YEAR, last_year + 1) if y not in stored]
+            if stored and stored[-1] not in years:
+                years.append(stored[-1])
+        years = sorted(years)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            entries = list(pool.map(self.ingest_year, years))
+        return [year for year, entry in zip(years, entries) if entry]
+
+    def partitions(self, filters=None):
+        entries = sorted(self._manifest['partitions'].values(), key=lambda e: (e['year'], e.get('mo') or 0))
+        if filters is None:
+            return entries
+        filters = Filter.coerce(filters)
+        return [e for e in entries if filters.may_match(e['stats'])]
+
+    def paths(self, filters=None):
+        return [os.path.join(self.directory, e['file']) for e in self.partitions(filters)]
+
+    def _write_partition(self, key, data):
+        file = 'gsod{}.parquet'.format(key)
+        path = os.path.join(self.directory, file)
+        pq.write_table(pa.Table.from_pandas(data, preserve_index=False), path + '.tmp', compression=self.compression)
+        os.replace(path + '.tmp', path)
+        stats = {}
+        for c in data.columns:
+            if c in ID_COLUMNS:
+                continue
+            values = data[c].to_numpy(dtype='float64')
+            valid = values[~np.isnan(values)]
+            stats[c] = [float(valid.min()), float(valid.max())] if len(valid) else [None, None]
+        year, _, mo = key.partition('-')
+        return {'year': int(year), 'mo': int(mo) if mo else None, 'file': file, 'rows': len(data),
+                'bytes': os.path.getsize(path), 'stats': stats, 'ingested': time.time()}
+
+    def _remove(self, entry):
+        path = os.path.join(self.directory, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _read_manifest(self):
+        return read_manifest(os.path.join(self.directory, self.manifest_name))
+
+    def _write_manifest(self):
+        write_manifest(os.path.join(self.directory, self.manifest_name), self._manifest)
+
+    @property
+    def columns(self):
+        return list(self._manifest['columns'])
+
+    @property
+    def years(self):
+        return sorted(set(e['year'] for e in self._manifest['partitions'].values()))
+
+    @property
+    def rows(self):
+        return sum(e['rows'] for e in self._manifest['partitions'].values())
@@ -0,0 +1,227 @@
+import cProfile
+import functools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+class Span():
+    """One timed stage: wall and CPU time, optional rows and bytes
+    processed, and memory high-water marks."""
+    def __init__(self, name, path, depth, fields):
+        self.name = name
+        self.path = path
+        self.depth = depth
+        self.fields = dict(fields)
+        self.rows = None
+        self.bytes = None
+        self.started = time.time()
+        self.wall = None
+        self.cpu = None
+        self.peak_memory = None
+        self.max_rss = None
+        self.profile = None
+        self.error = None
+        self._base = 0
+        self._peak = 0
+
+    def add(self, rows=None, bytes=None, **fields):
+        if rows is not None:
+            self.rows = (self.rows or 0) + int(rows)
+        if bytes is not None:
+            self.bytes = (self.bytes or 0) + int(bytes)
+        self.fields.update(fields)
+
+    @property
+    def rows_per_second(self):
+        if self.rows is None or not self.wall:
+            return None
+        return self.rows / self.wall
+
+    def to_dict(self):
+        record = {'name': self.name, 'path': self.path, 'depth': self.depth, 'started': self.started,
+                  'wall': self.wall, 'cpu': self.cpu, 'rows': self.rows, 'bytes': self.bytes,
+                  'rows_per_second': self.rows_per_second, 'peak_memory': self.peak_memory,
+                  'max_rss': self.max_rss}
+        if self.profile is not None:
+            record['profile'] = self.profile
+        if self.error is not None:
+            record['error'] = self.error
+        record.update(self.fields)
+        return record
+
+    def summary(self):
+        parts = ['{:.3f} s'.format(self.wall), 'cpu {:.3f} s'.format(self.cpu)]
+        if self.rows is not None:
+            parts.append('{} rows'.format(self.rows))
+            if self.rows_per_second is not None:
+                parts.append('{:.0f} rows/s'.format(self.rows_per_second))
+        if self.bytes is not None:
+            parts.append('{:.1f} MiB'.format(self.bytes / 2**20))
+        if self.peak_memory is not None:
+            parts.append('peak {:.1f} MiB'.format(self.peak_memory / 2**20))
+        return ', '.join(parts)
+
+class LogSink():
+    """Human-readable progress lines, indented by stage depth."""
+    def __init__(self, write=print):
+        self.write = write
+
+    def start(self, span):
+        self.write(_line(span, '{}...'.format(span.name)))
+
+    def finish(self, span):
+        status = 'failed' if span.error is not None else 'done'
+        self.write(_line(span, '{} {} ({}).'.format(span.name, status, span.summary())))
+
+class JsonLinesSink():
+    """One JSON object per finished stage, appended to a file."""
+    def __init__(self, path, run=None):
+        self.path = path
+        self.run = run
+        self._lock = threading.Lock()
+
+    def start(self, span):
+        pass
+
+    def finish(self, span):
+        record = span.to_dict()
+        if self.run is not None:
+            record['run'] = self.run
+        with self._lock, open(self.path, 'a') as file:
+            file.write(json.dumps(record) + '\n')
+
+class Recorder():
+    """Records nested stage spans and hands them to its sinks.
+
+    profile is None, True (every stage) or a collection of stage names; a
+    profiled stage is run under cProfile and its stats are dumped to
+    profile_dir. With trace_memory, tracemalloc reports each stage's peak
+    Python allocation; otherwise only the process max RSS is recorded.
+    """
+    def __init__(self, sinks=None, profile=None, profile_dir='.', trace_memory=False):
+        self.sinks = list(sinks) if sinks is not None else [LogSink()]
+        self.profile = profile
+        self.profile_dir = profile_dir
+        self.trace_memory = trace_memory
+        self.spans = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._profiles = 0
+
+    @contextmanager
+    def stage(self, name, write=None, rows=None, bytes=None, **fields):
+        stack = self._stack()
+        path = '/'.join([s.name for s in stack] + [name])
+        span = Span(name, path, len(stack), fields)
+        span.add(rows=rows, bytes=bytes)
+        for sink in self.sinks:
+            sink.start(span)
+        if write: write(_line(span, '{}...'.format(span.name)) + '\n')
+        profiler = self._start_profile(name)
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            current, peak = tracemalloc.get_traced_memory()
+            # the enclosing stage keeps the peak it saw before this one resets it
+            if stack:
+                stack[-1]._peak = max(stack[-1]._peak, peak)
+            span._base = current
+            tracemalloc.reset_peak()
+        stack.append(span)
+        start, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield span
+        except BaseException as error:
+            span.error = repr(error)
+            raise
+        finally:
+            span.wall = time.perf_counter() - start
+            span.cpu = time.process_time() - cpu
+            stack.pop()
+            if self.trace_memory:
+                span._peak = max(span._peak, tracemalloc.get_traced_memory()[1])
+                span.peak_memory = max(0, span._peak - span._base)
+                if stack:
+                    stack[-1]._peak = max(stack[-1]._peak, span._peak)
+            span.max_rss = _max_rss()
+            if profiler is not None:
+                profiler.disable()
+                span.profile = self._dump_profile(profiler, name)
+            with self._lock:
+                self.spans.append(span)
+            for sink in self.sinks:
+                sink.finish(span)
+            if write: write(_line(span, '{} {} ({}).'.format(span.name, 'failed' if span.error else 'done', span.summary())) + '\n')
+
+    def records(self):
+        with self._lock:
+            return [span.to_dict() for span in self.spans]
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def _start_profile(self, name):
+        if not self.profile or (self.profile is not True and name not in self.profile):
+            return None
+        if sys.getprofile() is not None:
+            # cProfile cannot nest; the enclosing profiled stage covers this one
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _dump_profile(self, profiler, name):
+        with self._lock:
+            self._profiles += 1
+            index = self._profiles
+        os.makedirs(self.profile_dir, exist_ok=True)
+        path = os.path.join(self.profile_dir, '{:03d}-{}.prof'.format(index, name.replace(' ', '_').replace('/', '_')))
+        profiler.dump_stats(path)
+        return path
+
+def _line(span, message):
+    return '  ' * (span.depth + 1) + '--> ' + message
+
+def _max_rss():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+_recorder = Recorder()
+
+def get_recorder():
+    return _recorder
+
+def set_recorder(recorder):
+    global _recorder
+    previous, _recorder = _recorder, recorder
+    return previous
+
+def configure(log=print, jsonl=None, run=None, profile=None, profile_dir='.', trace_memory=False):
+    """Replaces the default recorder: log is a write function for progress
+    lines (None to silence), jsonl a path for machine-readable spans."""
+    sinks = []
+    if log is not None:
+        sinks.append(LogSink(log))
+    if jsonl is not None:
+        sinks.append(JsonLinesSink(jsonl, run=run))
+    return set_recorder(Recorder(sinks, profile=profile, profile_dir=profile_dir, trace_memory=trace_memory))
+
+def stage(name, write=None, rows=None, bytes=None, **fields):
+    return _recorder.stage(name, write=write, rows=rows, bytes=bytes, **fields)
+
+def timed(name=None):
+    def decorator(function):
+        label = name or function.__qualname__
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(label):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
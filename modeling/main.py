@@ -1,8 +1,9 @@
 from . import PolyReg
+from .cache import DatasetCache
+from . import instrument
 from functools import reduce
 import os
-
-deg2features = ['1', 'mo', 'dewp', 'slp', 'stp', 'visib', 'wdsp', 'altitude', 'latitude', 'prcp', 'fog', 'rain_drizzle', 'snow_ice_pellets', 'hail', 'tornado_funnel_cloud', 'mo^2', 'mo dewp', 'mo slp', 'mo stp', 'mo visib', 'mo wdsp', 'mo altitude', 'mo latitude', 'mo prcp', 'mo fog', 'mo rain_drizzle', 'mo snow_ice_pellets', 'mo hail', 'mo tornado_funnel_cloud', 'dewp^2', 'dewp slp', 'dewp stp', 'dewp visib', 'dewp wdsp', 'dewp altitude', 'dewp latitude', 'dewp prcp', 'dewp fog', 'dewp rain_drizzle', 'dewp snow_ice_pellets', 'dewp hail', 'dewp tornado_funnel_cloud', 'slp^2', 'slp stp', 'slp visib', 'slp wdsp', 'slp altitude', 'slp latitude', 'slp prcp', 'slp fog', 'slp rain_drizzle', 'slp snow_ice_pellets', 'slp hail', 'slp tornado_funnel_cloud', 'stp^2', 'stp visib', 'stp wdsp', 'stp altitude', 'stp latitude', 'stp prcp', 'stp fog', 'stp rain_drizzle', 'stp snow_ice_pellets', 'stp hail', 'stp tornado_funnel_cloud', 'visib^2', 'visib wdsp', 'visib altitude', 'visib latitude', 'visib prcp', 'visib fog', 'visib rain_drizzle', 'visib snow_ice_pellets', 'visib hail', 'visib tornado_funnel_cloud', 'wdsp^2', 'wdsp altitude', 'wdsp latitude', 'wdsp prcp', 'wdsp fog', 'wdsp rain_drizzle', 'wdsp snow_ice_pellets', 'wdsp hail', 'wdsp tornado_funnel_cloud', 'altitude^2', 'altitude latitude', 'altitude prcp', 'altitude fog', 'altitude rain_drizzle', 'altitude snow_ice_pellets', 'altitude hail', 'altitude tornado_funnel_cloud', 'latitude^2', 'latitude prcp', 'latitude fog', 'latitude rain_drizzle', 'latitude snow_ice_pellets', 'latitude hail', 'latitude tornado_funnel_cloud', 'prcp^2', 'prcp fog', 'prcp rain_drizzle', 'prcp snow_ice_pellets', 'prcp hail', 'prcp tornado_funnel_cloud', 'fog^2', 'fog rain_drizzle', 'fog snow_ice_pellets', 'fog hail', 'fog tornado_funnel_cloud', 'rain_drizzle^2', 'rain_drizzle snow_ice_pellets', 'rain_drizzle hail', 'rain_drizzle tornado_funnel_cloud', 'snow_ice_pellets^2', 'snow_ice_pellets hail', 'snow_ice_pellets tornado_funnel_cloud', 'hail^2', 'hail tornado_funnel_cloud', 'tornado_funnel_cloud^2']
+import time
 
 def main():
     cols = ['mo','temp', 'dewp','slp', 'stp', 'visib', 'wdsp', 'altitude', 'latitude', 'prcp','fog','rain_drizzle','snow_ice_pellets','hail','tornado_funnel_cloud']
@@ -23,59 +24,76 @@ def main():
         os.mkdir(PolyReg.generate_model_path(id))
     output_path = os.path.join(PolyReg.generate_model_path(id),'output.txt')
     degree = int(input("Degree of polynomial regression [2]: > ") or 2)
-    train_data_path = input("Train data path [None]: > ") or None
-    test_data_path = input("Test data path [None]: > ") or None
+    solver = ''
+    while solver not in ('lstsq', 'normal'):
+        solver = (input("Solver, sklearn lstsq or streaming normal equations (lstsq/normal) [normal]: > ") or 'normal').lower()
+    train_data_path = input("Train data path, joblib file or directory of parquet shards [None]: > ") or None
+    test_data_path = input("Test data path, joblib file or directory of parquet shards [None]: > ") or None
+    train_shards = None
+    test_shards = None
+    if train_data_path is not None and os.path.isdir(train_data_path):
+        train_shards, train_data_path = train_data_path, None
+    if test_data_path is not None and os.path.isdir(test_data_path):
+        test_shards, test_data_path = test_data_path, None
+    cache = None
+    if (input("Use local data cache (Y/n) [Y]: > ") or 'y').lower() == 'y':
+        cache = DatasetCache()
+    compact = (input("Keep data compact, float32 measurements and uint8 flags (Y/n) [Y]: > ") or 'y').lower() == 'y'
+    profile = (input("Profile stages with cProfile (y/N) [N]: > ") or 'n').lower() == 'y'
+    # every stage is also recorded to stages.jsonl for comparison across runs
+    instrument.configure(jsonl=os.path.join(PolyReg.generate_model_path(id),'stages.jsonl'), run=time.strftime('%Y-%m-%dT%H:%M:%S'),
+                         profile=True if profile else None, profile_dir=os.path.join(PolyReg.generate_model_path(id),'profiles'))
     if model_choice == 1:
         numrows = int(input("Max number of rows in model [100000]: > ") or 100000)
         if os.path.exists(output_path):
             os.remove(output_path)
         output = open(output_path,'w')
+        write = lambda line: output.write(line if line.endswith('\n') else line + '\n')
         print("Opening output file at {}".format(output_path))
         print("Creating test model.")
         output.write("Creating test model.\n")
-        model = PolyReg(id,max_rows=numrows,train_data_path=train_data_path,test_data_path=test_data_path,data_columns=cols)
+        model = PolyReg(id,max_rows=numrows,train_data_path=train_data_path,test_data_path=test_data_path,data_columns=cols,cache=cache,train_shards=train_shards,test_shards=test_shards,compact=compact)
     elif model_choice == 2:
+        streams = int(input("Parallel BigQuery read streams [8]: > ") or 8)
         output = open(output_path,'w')
+        write = lambda line: output.write(line if line.endswith('\n') else line + '\n')
         print("Creating full model.")
         print("Opening output file at {}".format(output_path))
         output.write("Creating full model.\n")
-        model = PolyReg(id,max_rows=None,train_data_path=train_data_path,test_data_path=test_data_path,data_columns=cols)
+        model = PolyReg(id,max_rows=None,train_data_path=train_data_path,test_data_path=test_data_path,data_columns=cols,cache=cache,streams=streams,train_shards=train_shards,test_shards=test_shards,compact=compact)
     
     print("  --> Data Loaded")
     output.write("  --> Data Loaded\n")
-    if train_data_path!=os.path.join(PolyReg.generate_model_path(id),'train_data.joblib'):
+    if train_shards is None and train_data_path!=os.path.join(PolyReg.generate_model_path(id),'train_data.joblib'):
         model.save_file('train_data',dir_path=PolyReg.generate_model_path(id))
-    if train_data_path!=os.path.join(PolyReg.generate_model_path(id),'test_data.joblib'):
+    if test_shards is None and train_data_path!=os.path.join(PolyReg.generate_model_path(id),'test_data.joblib'):
         model.save_file('test_data',dir_path=PolyReg.generate_model_path(id))
 
-    train_desc = model.train_data._data.describe()
-    test_desc = model.test_data._data.describe()
-    print("    --> Train Data Summary")
-    output.write("  --> Train Data Summary\n")
-    print(train_desc.to_string())
-    output.write(train_desc.to_string())
-    output.write("\n")
-    print("    --> Test Data Summary")
-    output.write("    --> Test Data Summary\n")
-    print(test_desc.to_string())
-    output.write(test_desc.to_string())
-    output.write("\n")
+    if not model.train_data.streaming:
+        train_desc = model.train_data.frame().describe()
+        print("    --> Train Data Summary")
+        output.write("  --> Train Data Summary\n")
+        print(train_desc.to_string())
+        output.write(train_desc.to_string())
+        output.write("\n")
+    if not model.test_data.streaming:
+        test_desc = model.test_data.frame().describe()
+        print("    --> Test Data Summary")
+        output.write("    --> Test Data Summary\n")
+        print(test_desc.to_string())
+        output.write(test_desc.to_string())
+        output.write("\n")
     print("  --> Model Initialized")
     output.write("  --> Model Initialized\n")
-    model.train(degree=degree,write=output.write)
-    print("  --> Model Trained")
-    output.write("  --> Model Trained\n")
-    features = cols
-    features.remove(target) 
-    if degree > 1:
-        try:
-            features = model.model.model.named_steps['kernel']._poly_features.get_feature_names(features)
-        except:
-            features = deg2features
+    with instrument.stage("Training", write=write):
+        model.train(degree=degree,write=write,solver=solver)
+    features = model.model.term_names
     coefs = model.model.model.named_steps['regression'].coef_[0]
     inter = model.model.model.named_steps['regression'].intercept_[0]
     eqn = "{}".format(round(inter,5))
-    for i in range(1,len(features)):
+    for i in range(len(features)):
+        if features[i] == '1':
+            continue
         if len(eqn)>64 and eqn.rfind('\n',len(eqn)-65) == -1:
             eqn += "\n            "+" + "+"{}({})".format(round(coefs[i],5),features[i])
         else:
@@ -84,13 +102,10 @@ def main():
     output.write("    --> Model equation:\n")
     print("        {} = {}".format(target,eqn))
     output.write("        {} = {}\n".format(target,eqn))
-    print("  --> Testing Model...")
-    output.write("  --> Testing Model...")
-    model.test(write=output.write)
-    print("  --> Model Tested")
-    output.write("  --> Model Tested\n")
+    with instrument.stage("Testing", write=write):
+        model.test(write=write)
     model.results()
-    model.results(write=output.write)
+    model.results(write=write)
     output.close()
     model.save_file('model',dir_path=PolyReg.generate_model_path(id))
 
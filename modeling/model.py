@@ -1,10 +1,12 @@
 import numpy as np
 import pandas as pd
 from sklearn.linear_model import LinearRegression
-from sklearn.metrics import mean_squared_error, r2_score, explained_variance_score, mean_absolute_error
 from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import PolynomialFeatures
-import time
+from .metrics import RunningMetrics, regression_metrics
+from .evaluator import PolynomialEvaluator
+from .stats import SufficientStats
+from .expansion import make_expansion, accumulate
+from .instrument import stage
 
 class Model():
     def __init__(self):
@@ -12,8 +14,11 @@ class Model():
         self._features = None
         self._poly_features = None
         self._model = None
+        self._degree = None
+        self._stats = None
+        self._evaluator = None
 
-    def train(self, target, train_data, degree=2,write=None):
+    def train(self, target, train_data, degree=2,write=None,solver='lstsq',chunk_size=250000,features=None):
         if self._model is not None:
             print("Warning: Existing model will be overwritten.")
             response = ''
@@ -22,63 +27,144 @@ class Model():
             if response == 'n':
                 return
         self._target = [target]
-        self._features = train_data.columns
-        self._features.remove(target)
+        # every column but the target, unless features are given
+        self._features = list(features) if features is not None else [c for c in train_data.columns if c != target]
         self._degree = degree
         target_predicted = None
+        self._model = self._build_pipeline()
+
+        if train_data.streaming and solver != 'normal':
+            print("      --> Streaming data requires the normal-equations solver.")
+            solver = 'normal'
+
+        with stage("Training model", write=write, solver=solver, degree=degree) as span:
+            if solver == 'normal':
+                self._fit_normal_equations(train_data.iter_arrays(self.features, self.target, chunk_size, dtype=None))
+                span.add(rows=self._stats.rows)
+            elif solver == 'lstsq':
+                self._stats = None
+                X = train_data.array(self.features)
+                self._model.fit(X,train_data.array(self.target))
+                span.add(rows=len(X), bytes=X.nbytes)
+            else:
+                raise ValueError("Unknown solver '{}'.".format(solver))
+            self.compile()
+
+        if train_data.streaming:
+            return self._score_chunks(train_data, chunk_size, 'train', write)
+        return self._score(train_data, 'train', write)
+
+    def _score(self, dataset, label, write=None):
+        X = dataset.array(self.features, dtype=None)
+        with stage("Predicting {} data".format(label), write=write, rows=len(X), bytes=X.nbytes):
+            target_predicted = self.predict(X)
+        with stage("Calculating {} accuracy metrics".format(label), write=write, rows=len(X)):
+            return regression_metrics(dataset.array(self.target, dtype=None), target_predicted)
+
+    def _fit_normal_equations(self, chunks):
+        # One pass over the data: expand each (X, y) chunk into polynomial
+        # terms, fold it into X'X / X'y and solve once at the end. Chunks may
+        # be compact (float32/uint8); only the chunk in hand is widened to
+        # float64, so the accumulation keeps full precision.
+        kernel = self._model.named_steps.get('kernel')
+        if kernel is not None:
+            kernel.fit(np.zeros((1, len(self.features))))
+        self._stats = self._statistics(chunks)
+        if self._stats.rows == 0:
+            raise ValueError("No training data.")
+        coef, intercept = self._stats.solve()
+        self._set_coefficients(coef, intercept)
+
+    def _statistics(self, chunks):
+        kernel = self._model.named_steps.get('kernel')
+        stats = SufficientStats(kernel.n_output_features_ if kernel is not None else len(self.features))
+        for X, y in chunks:
+            accumulate(stats, kernel, np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64))
+        return stats
+
+    def update(self, dataset, write=None, chunk_size=250000):
+        """Folds new rows into the stored statistics and re-solves; the cost
+        is one pass over dataset, not over everything trained on so far."""
+        return self._refit(dataset, 1, write, chunk_size)
+
+    def downdate(self, dataset, write=None, chunk_size=250000):
+        """Removes rows that were trained on (e.g. years leaving a sliding
+        window) from the stored statistics and re-solves."""
+        return self._refit(dataset, -1, write, chunk_size)
+
+    def _refit(self, dataset, sign, write, chunk_size):
+        if self._stats is None:
+            raise ValueError("Model has no sufficient statistics; train it with solver='normal' first.")
+        label = "Updating" if sign > 0 else "Downdating"
+        with stage("{} model".format(label), write=write) as span:
+            stats = self._statistics(dataset.iter_arrays(self.features, self.target, chunk_size, dtype=None))
+            if sign > 0:
+                self._stats += stats
+            else:
+                self._stats -= stats
+            span.add(rows=stats.rows, total_rows=self._stats.rows)
+            coef, intercept = self._stats.solve()
+            self._set_coefficients(coef, intercept)
+            self.compile()
+        return self._stats.score(coef, intercept)
+
+    def _build_pipeline(self, powers=None):
+        # flag columns are expanded without their redundant powers
         if self._degree is None or self._degree < 2:
-            self._model = Pipeline([('regression',LinearRegression())])
-        else:
-            self._model = Pipeline([('kernel',PolynomialFeatures(degree=self._degree)), ('regression',LinearRegression())])
-
-        print("      --> Training model...")
-        if write: write("      --> Training model...\n")
-        start = time.perf_counter()
-        self._model.fit(train_data.data.loc[:, self.features],train_data.data.loc[:, self.target])
-        cost = time.perf_counter() - start
-        print("    --> Model trained ({} s).".format(cost))
-        if write: write("    --> Model trained ({} s).".format(cost))
-
-        print("    --> Predicting train data...")
-        if write: write("    --> Predicting train data...\n")
-        start = time.perf_counter()
-        target_predicted = self._model.predict(train_data.data.loc[:, self.features])
-        cost = time.perf_counter() - start
-        print("    --> Train data predicted ({} s).".format(cost))
-        if write: write("    --> Train data predicted ({} s).\n".format(cost))
-
-        print("    --> Calculating train accuracy metrics...")
-        if write: write("    --> Calculating train accuracy metrics...\n")
-        start = time.perf_counter()
-        me = mean_absolute_error(train_data.data.loc[:, self.target], target_predicted)
-        var = explained_variance_score(train_data.data.loc[:, self.target], target_predicted)
-        rmse = np.sqrt(mean_squared_error(train_data.data.loc[:, self.target], target_predicted))
-        r2 = r2_score(train_data.data.loc[:, self.target], target_predicted)
-        cost = time.perf_counter() - start
-        print("    --> Train metrics calculated ({} s).".format(cost))
-        if write: write("    --> Train metrics calculated ({} s).\n".format(cost))
-        return {'R-Squared':r2, "Explained Variance":var, 'Root Mean Squared Error':rmse, 'Mean Absolute Error':me}
-
-    def test(self,test_data,write=None):
-        print("    --> Predicting test data...")
-        if write: write("      --> Predicting test data...\n")
-        start = time.perf_counter()
-        test_predicted = self._model.predict(test_data.data.loc[:,self._features])
-        cost = time.perf_counter() - start
-        print("    --> Test data predicted ({} s).".format(cost))
-        if write: write("      --> Test data predicted ({} s).\n".format(cost))
-        
-        print("    --> Calculating test accuracy metrics...")
-        if write: write("      --> Calculating test accuracy metrics...\n")
-        start = time.perf_counter()
-        me = mean_absolute_error(test_data.data.loc[:, self.target], test_predicted)
-        var = explained_variance_score(test_data.data.loc[:, self.target], test_predicted)
-        rmse = np.sqrt(mean_squared_error(test_data.data.loc[:, self.target], test_predicted))
-        r2 = r2_score(test_data.data.loc[:, self.target], test_predicted)
-        cost = time.perf_counter() - start
-        print("    --> Test metrics calculated ({} s).".format(cost))
-        if write: write("    --> Test metrics calculated ({} s).\n".format(cost))
-        return {'R-Squared':r2, "Explained Variance":var, 'Root Mean Squared Error':rmse, 'Mean Absolute Error':me}
+            return Pipeline([('regression',LinearRegression())])
+        return Pipeline([('kernel',make_expansion(self._features, self._degree, powers=powers)), ('regression',LinearRegression())])
+
+    def _set_coefficients(self, coef, intercept):
+        # Writes solved coefficients into the sklearn pipeline so it behaves
+        # like one fitted with LinearRegression.fit.
+        kernel = self._model.named_steps.get('kernel')
+        if kernel is not None and not hasattr(kernel, 'powers_'):
+            kernel.fit(np.zeros((1, len(self.features))))
+        regression = self._model.named_steps['regression']
+        regression.coef_ = np.asarray(coef, dtype=np.float64).reshape(1, -1)
+        regression.intercept_ = np.array([intercept], dtype=np.float64)
+        regression.n_features_in_ = regression.coef_.shape[1]
+
+    def restore(self, target, features, degree, coef, intercept, stats=None, powers=None):
+        self._target = [target]
+        self._features = list(features)
+        self._degree = degree
+        self._stats = stats
+        # saved powers keep the term layout the coefficients were solved in
+        self._model = self._build_pipeline(powers if degree is not None and degree >= 2 else None)
+        self._set_coefficients(coef, intercept)
+        self.compile()
+
+    def describe(self):
+        if self._model is None:
+            return {}
+        regression = self._model.named_steps['regression']
+        return {'target': self._target[0], 'features': list(self._features), 'degree': self._degree,
+                'powers': self.predictor.powers.tolist(),
+                'coef': np.asarray(regression.coef_, dtype=np.float64).ravel().tolist(),
+                'intercept': float(np.asarray(regression.intercept_, dtype=np.float64).ravel()[0])}
+
+    def _score_chunks(self, dataset, chunk_size, label, write=None):
+        with stage("Predicting and scoring {} data in chunks".format(label), write=write) as span:
+            metrics = RunningMetrics()
+            for X, y in dataset.iter_arrays(self.features, self.target, chunk_size, dtype=None):
+                metrics.update(y, self.predict(X))
+                span.add(rows=len(X), bytes=X.nbytes)
+        return metrics.results()
+
+    def test(self,test_data,write=None,chunk_size=250000):
+        if test_data.streaming:
+            return self._score_chunks(test_data, chunk_size, 'test', write)
+        return self._score(test_data, 'test', write)
+
+    def compile(self):
+        self._evaluator = PolynomialEvaluator.from_pipeline(self._model, features=self._features)
+        return self._evaluator
+
+    def predict(self, X, chunk_size=65536, n_jobs=1):
+        if self._evaluator is None:
+            self.compile()
+        return self._evaluator.predict(X, chunk_size=chunk_size, n_jobs=n_jobs)
 
     @property
     def target(self):
@@ -92,3 +178,33 @@ class Model():
     def model(self):
         return self._model
 
+    @property
+    def degree(self):
+        return self._degree
+
+    @property
+    def term_names(self):
+        """Names of the terms the coefficients belong to, e.g. 'mo dewp'."""
+        if self._model is None:
+            return None
+        kernel = self._model.named_steps.get('kernel')
+        if kernel is None:
+            return list(self._features)
+        if not hasattr(kernel, 'powers_'):
+            kernel.fit(np.zeros((1, len(self._features))))
+        return list(kernel.get_feature_names_out(self._features))
+
+    @property
+    def stats(self):
+        return self._stats
+
+    @property
+    def evaluator(self):
+        return self._evaluator
+
+    @property
+    def predictor(self):
+        if self._evaluator is None and self._model is not None:
+            self.compile()
+        return self._evaluator
+
@@ -0,0 +1,41 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+# Shared memory blocks mapped by this pool process; kept open for the
+# lifetime of the process so the arrays built on them stay valid.
+_blocks = []
+
+def _attach(name, shape, dtype, initializer, args):
+    block = shared_memory.SharedMemory(name=name)
+    _blocks.append(block)
+    initializer(np.ndarray(shape, dtype=dtype, buffer=block.buf), *args)
+
+def map_shared(function, tasks, data, initializer, args=(), workers=1, order=None):
+    """Runs function over tasks after initializer(data, *args) has set up
+    each worker, returning the results in task order.
+
+    With one worker everything runs in this process. Otherwise data (its
+    rows taken in order, when given) is copied once into a shared memory
+    block that every pool process maps, instead of being pickled with each
+    task. data keeps its dtype, so compact blocks stay compact.
+    """
+    tasks = list(tasks)
+    workers = max(1, min(workers, len(tasks)))
+    if workers <= 1:
+        initializer(data if order is None else data[order], *args)
+        return [function(task) for task in tasks]
+    block = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    try:
+        shared = np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)
+        if order is None:
+            shared[:] = data
+        else:
+            np.take(data, order, axis=0, out=shared)
+        del shared
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach,
+                                 initargs=(block.name, data.shape, data.dtype, initializer, args)) as pool:
+            return list(pool.map(function, tasks))
+    finally:
+        block.close()
+        block.unlink()
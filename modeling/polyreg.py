@@ -1,43 +1,59 @@
 import numpy as np
 import pandas as pd
-from sklearn.externals.joblib import dump, load
+from joblib import load
 from statsmodels.stats.anova import anova_lm
 import pickle
 from functools import reduce
 import easygui 
 import os
 from . import Dataset,Model
+from . import artifact
+from .instrument import stage
+from .crossval import CrossValidation
+from .regions import GridIndex, RegionalModel
 
 class PolyReg():
-    def __init__(self, model_id, model_ext='.joblib', train_data_path=None,test_data_path=None,path=None,max_rows=100000, data_columns=['mo','temp', 'dewp', 'slp', 'stp', 'visib', 'wdsp', 'altitude', 'longitude', 'latitude', 'prcp'], data_where=None,target='temp', model_compress=0):
+    def __init__(self, model_id, model_ext='.joblib', train_data_path=None,test_data_path=None,path=None,max_rows=100000, data_columns=['mo','temp', 'dewp', 'slp', 'stp', 'visib', 'wdsp', 'altitude', 'longitude', 'latitude', 'prcp'], data_where=None,target='temp', model_compress=0, source=None, cache=None, streams=1, train_shards=None, test_shards=None, store=None, test_where=None, compact=False, pack_flags=False, group_columns=None):
         self.model_id = None
         self.model_path = path
         self.model = Model()
         self.target = target
         self.train_results = None
         self.test_results = None
+        self.cv_results = None
+        self.regions = None
+        # grouping columns (e.g. 'stn' or 'year') are loaded with the data
+        # for cross-validation folds but are never regression features
+        self.group_columns = list(group_columns) if group_columns is not None else []
         if self.model_path is not None:
             self.model = Model()
             self.train_data = Dataset(columns=None)
             self.test_data = Dataset(columns=None)
             self.load_model_from_path(path)
             return
-        print("  --> Loading Train Data")        
-        if train_data_path is not None:
-            self.train_data = Dataset(columns=None)
-            self.train_data._data = load(train_data_path)
-        else:
-            self.train_data = Dataset(columns=data_columns, max_size=max_rows,data_where=data_where)
-        print("  --> Train Data Loaded")
-        print("  --> Loading Test Data")        
-        if test_data_path is not None:
-            self.test_data = Dataset(columns=None)
-            self.test_data._data = load(test_data_path)
-        else:
-            self.test_data = Dataset(table_name="test",columns=data_columns, max_size=int(max_rows/5) if max_rows else None,data_where=data_where)
-        print("  --> Loading Test Data")                
+        data_columns = list(data_columns) + [c for c in self.group_columns if c not in data_columns]
+        with stage("Loading Train Data") as span:
+            if train_shards is not None:
+                self.train_data = Dataset(columns=data_columns, shards=train_shards,data_where=data_where,compact=compact,pack_flags=pack_flags)
+            elif train_data_path is not None:
+                self.train_data = Dataset(columns=None)
+                self.train_data._data = load(train_data_path)
+            else:
+                self.train_data = Dataset(columns=data_columns, max_size=max_rows,data_where=data_where,source=source,cache=cache,streams=streams,store=store,compact=compact,pack_flags=pack_flags)
+            if not self.train_data.streaming:
+                span.add(rows=len(self.train_data.data))
+        with stage("Loading Test Data") as span:
+            if test_shards is not None:
+                self.test_data = Dataset(table_name="test", columns=data_columns, shards=test_shards,data_where=test_where if test_where is not None else data_where,compact=compact,pack_flags=pack_flags)
+            elif test_data_path is not None:
+                self.test_data = Dataset(columns=None)
+                self.test_data._data = load(test_data_path)
+            else:
+                self.test_data = Dataset(table_name="test",columns=data_columns, max_size=int(max_rows/5) if max_rows else None,data_where=test_where if test_where is not None else data_where,source=source,cache=cache,streams=streams,store=store,compact=compact,pack_flags=pack_flags)
+            if not self.test_data.streaming:
+                span.add(rows=len(self.test_data.data))
 
-    def train(self,degree=2,write=None):
+    def train(self,degree=2,write=None,solver='lstsq',chunk_size=250000):
         if self.model.model is not None:
             print("Warning: Existing model will be overwritten.")
             response = ''
@@ -45,10 +61,65 @@ class PolyReg():
                 response = input("Continue? (Y/n) > ").lower()
             if response == 'n':
                 return
-        self.train_results = self.model.train(self.target, self.train_data, degree=degree,write=write)
+        self.train_results = self.model.train(self.target, self.train_data, degree=degree,write=write,solver=solver,chunk_size=chunk_size,features=self.features)
+        self.regions = None
+
+    def train_regions(self,degree=2,cell_size=10.0,min_rows=None,workers=None,write=None,chunk_size=250000):
+        # one model per cell_size-degree grid cell of station coordinates;
+        # the global fit becomes self.model and serves sparse cells
+        self.regions = RegionalModel(GridIndex(cell_size), min_rows=min_rows, workers=workers)
+        self.train_results = self.regions.train(self.target, self.train_data, degree=degree,write=write,chunk_size=chunk_size,features=self.features)
+        self.model = self.regions.fallback
+
+    def test(self,write=None,chunk_size=250000):
+        if self.regions is not None:
+            self.test_results = self.regions.test(self.test_data,write=write,chunk_size=chunk_size)
+            return
+        self.test_results = self.model.test(self.test_data,write=write,chunk_size=chunk_size)
+
+    def update(self,dataset,write=None,chunk_size=250000):
+        # e.g. a newly published year; train results then cover every row
+        # in the statistics (MAE is not available from them)
+        self._check_global('update')
+        self.train_results = self.model.update(dataset,write=write,chunk_size=chunk_size)
+        return self.train_results
+
+    def downdate(self,dataset,write=None,chunk_size=250000):
+        self._check_global('downdate')
+        self.train_results = self.model.downdate(dataset,write=write,chunk_size=chunk_size)
+        return self.train_results
+
+    def _check_global(self,action):
+        if self.regions is not None:
+            raise ValueError("Cannot {} regional models; retrain them with train_regions.".format(action))
 
-    def test(self,write=None):
-        self.test_results = self.model.test(self.test_data,write=write)
+    def cross_validate(self,k=5,degree=2,by=None,ridge=0.0,write=None,chunk_size=250000):
+        # folds are drawn from the train table; by names one of the
+        # group_columns (e.g. 'stn' or 'year'), which train and test do not
+        # use as features either
+        if by is not None and by not in self.group_columns:
+            raise ValueError("Cross-validation groups must be loaded with group_columns=['{}'].".format(by))
+        cv = CrossValidation(self.train_data, self.target, k=k, degree=degree, by=by, features=self.features, chunk_size=chunk_size)
+        self.cv_results = cv.run(ridge=ridge)
+        if write is not None:
+            write("    --> {}-fold cross-validation{}:".format(k, " by {}".format(by) if by is not None else ""))
+            write(self.cv_results.to_string())
+        return self.cv_results
+
+    @property
+    def features(self):
+        return [c for c in self.train_data.columns if c != self.target and c not in self.group_columns]
+
+    def predict(self, batch, chunk_size=65536, n_jobs=1):
+        # with regional models each row goes to its grid cell's model
+        cells = None
+        if isinstance(batch, (pd.DataFrame, dict)):
+            if self.regions is not None:
+                cells = self.regions.lookup(batch)
+            batch = np.column_stack([np.asarray(batch[f], dtype=np.float64) for f in self.model.features])
+        if self.regions is not None:
+            return self.regions.predict(batch, cells, chunk_size=chunk_size, n_jobs=n_jobs)
+        return self.model.predict(batch, chunk_size=chunk_size, n_jobs=n_jobs)
 
     def results(self,write=print):
         write("    --> Train Results:")
@@ -86,62 +157,101 @@ class PolyReg():
             return None
 
     def load_model_from_path(self,path):
-        if os.path.exists(path):
-            print("Loading PolyReg...")
+        if artifact.is_artifact(path):
+            self.load_artifact(path)
+        elif os.path.exists(path):
+            self.load_legacy(path)
+        else:
+            print('PolyReg files not found')
+
+    def load_artifact(self,path):
+        print("Loading PolyReg...")
+        header = artifact.read_header(path)
+        self.target = header['target']
+        self.model.restore(header['target'], header['features'], header['degree'], header['coef'], header['intercept'],
+                           stats=artifact.read_stats(path), powers=header.get('powers'))
+        print(" --> Model loaded.")
+        self.regions = artifact.read_regions(path, self.model)
+        if self.regions is not None:
+            print(" --> {} regional models loaded.".format(len(self.regions.models)))
+        self.group_columns = header.get('group_columns', [])
+        self.train_results = header.get('train_results')
+        self.test_results = header.get('test_results')
+        for name in header.get('datasets', {}):
+            dataset = Dataset(table_name=name, columns=artifact.dataset_columns(path, name),
+                              loader=lambda name=name: artifact.read_dataset(path, name))
+            if name == 'train':
+                self.train_data = dataset
+            elif name == 'test':
+                self.test_data = dataset
+        self.model_path = path
+        print('PolyReg loaded.')
+
+    def load_legacy(self,path):
+        print("Loading PolyReg (joblib)...")
+        if os.path.exists(os.path.join(path,'train_data.joblib')):
             self.train_data._data = load(os.path.join(path,'train_data.joblib'))
             print(" --> Train Data loaded.")
+        if os.path.exists(os.path.join(path,'test_data.joblib')):
             self.test_data._data = load(os.path.join(path,'test_data.joblib'))
             print(" --> Test Data loaded.")
-            self.model._model = load(os.path.join(path,'model.joblib'))
-            print(" --> Model loaded.")
-            if os.path.exists(os.path.join(path,'target.joblib')):
-                self.target = load(os.path.join(path,'target.joblib'))
-                self.model._target = [self.target]
-                self.model._features = self.train_data.columns
-                self.model._features.remove(self.target)
-                print("   --> Model metadata loaded.")
+        if not os.path.exists(os.path.join(path,'model.joblib')):
+            print('PolyReg model file not found')
+            return
+        self.model._model = load(os.path.join(path,'model.joblib'))
+        kernel = self.model._model.named_steps.get('kernel')
+        self.model._degree = kernel.degree if kernel is not None else 1
+        print(" --> Model loaded.")
+        if os.path.exists(os.path.join(path,'target.joblib')):
+            self.target = load(os.path.join(path,'target.joblib'))
+            self.model._target = [self.target]
+            self.model._features = [c for c in self.train_data.columns if c != self.target]
+            print("   --> Model metadata loaded.")
+        if os.path.exists(os.path.join(path,'poly_features.joblib')):
             self.model._poly_features = load(os.path.join(path,'poly_features.joblib'))
             print(" --> PolynomialFeatures loaded.")
-            self.model_path = path
-            print('PolyReg loaded.')
-
-        else:
-            print('PolyReg files not found')
+        self.model_path = path
+        print('PolyReg loaded.')
 
+    @classmethod
+    def convert_legacy(cls,path,include_data=True):
+        pm = PolyReg(None,path=path)
+        if pm.model.model is None:
+            return None
+        pm.save(include_data=include_data)
+        return pm
 
-    def save(self):
+    def save(self,include_data=True):
         if self.model_path is None:
             self.save_as(self.model_path)
         if self.model_path is None: return
-        try:
-            os.mkdir(self.model_path)
-        except FileExistsError as error:
-            pass
-        if self.target is not None:
-            dump(self.target, os.path.join(self.model_path,'target.joblib'))
-        dump(self.model._model, os.path.join(self.model_path,'model.joblib'))
-        dump(self.model._poly_features, os.path.join(self.model_path,'poly_features.joblib'))
-        dump(self.train_data._data, os.path.join(self.model_path,'train_data.joblib'))
-        dump(self.test_data._data, os.path.join(self.model_path,'test_data.joblib'))
-    
+        self.save_file('model',dir_path=self.model_path)
+        if include_data:
+            self.save_file('train_data',dir_path=self.model_path)
+            self.save_file('test_data',dir_path=self.model_path)
+
     def save_file(self,file,dir_path=None):
         if dir_path is None:
                 dir_path = self.set_path()
                 if dir_path is None: return
-        try:
-            os.mkdir(dir_path)
-        except FileExistsError as error:
-            pass
-        if os.path.exists(os.path.join(dir_path,file+'.joblib')):
-            os.remove(os.path.join(dir_path,file+'.joblib'))
+        os.makedirs(dir_path, exist_ok=True)
         if file == 'model':
-            if self.target is not None:
-                dump(self.target, os.path.join(dir_path,'target.joblib'))
-            dump(self.model._model, os.path.join(dir_path,'model.joblib'))
+            header = dict(self.model.describe(), target=self.target,
+                          train_results=self.train_results, test_results=self.test_results,
+                          group_columns=self.group_columns, regions=None)
+            artifact.update_header(dir_path, **header)
+            if self.model.stats is not None:
+                artifact.write_stats(dir_path, self.model.stats)
+            else:
+                artifact.remove_stats(dir_path)
+            if self.regions is not None:
+                artifact.write_regions(dir_path, self.regions)
         elif file == 'train_data':
-            dump(self.train_data._data, os.path.join(dir_path,'train_data.joblib'))
+            if self.train_data.data is not None:
+                artifact.write_dataset(dir_path, 'train', self.train_data.frame())
         elif file == 'test_data':
-            dump(self.test_data._data, os.path.join(dir_path,'test_data.joblib'))
+            if self.test_data.data is not None:
+                artifact.write_dataset(dir_path, 'test', self.test_data.frame())
 
     def set_path(self):
         path = easygui.diropenbox(msg='Save as..',title='Save PolyReg Files',default="./")
@@ -154,10 +264,7 @@ class PolyReg():
         while True:
             if path is not None:
                 self.model_path = path
-                files_exist = False
-                for file in ['model','poly_features','train_data','test_data']:
-                    if os.path.exists(os.path.join(path,file+'.joblib')):
-                        files_exist = True
+                files_exist = artifact.is_artifact(path)
                 if not files_exist: 
                     self.save()
                     return
@@ -166,9 +273,7 @@ class PolyReg():
                 while response != 'y' and response != 'n':
                     response = input("Continue? (Y/n) > ").lower()
                 if response == 'y':
-                    for file in ['model','poly_features','train_data','test_data']:
-                        if os.path.exists(os.path.join(path,file+'.joblib')):
-                            os.remove(os.path.join(path,file+'.joblib'))
+                    os.remove(os.path.join(path,artifact.HEADER_NAME))
             else:
                 path = easygui.diropenbox(msg='Save as..',title='Save PolyReg Files',default="./")
                 if path is None: return
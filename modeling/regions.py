@@ -0,0 +1,221 @@
+import os
+import numpy as np
+from .model import Model
+from .metrics import RunningMetrics
+from .stats import SufficientStats
+from .expansion import make_expansion, accumulate, accumulate_ranges
+from .instrument import stage
+
+class GridIndex():
+    """Grid of cell_size x cell_size degree cells over station coordinates.
+
+    A row's cell is a fixed function of its station's latitude and
+    longitude, so every row of a station lands in the same cell. Cells are
+    numbered row-major from the south-west corner; rows without valid
+    coordinates get cell -1.
+    """
+    def __init__(self, cell_size=10.0, latitude='latitude', longitude='longitude'):
+        if not 0 < cell_size <= 180:
+            raise ValueError("Grid cell size must be in (0, 180] degrees, got {}.".format(cell_size))
+        self.cell_size = float(cell_size)
+        self.latitude = latitude
+        self.longitude = longitude
+        self._rows = int(np.ceil(180 / self.cell_size))
+        self._columns = int(np.ceil(360 / self.cell_size))
+
+    def cells(self, latitude, longitude):
+        latitude = np.asarray(latitude, dtype=np.float64)
+        longitude = np.asarray(longitude, dtype=np.float64)
+        valid = np.isfinite(latitude) & np.isfinite(longitude)
+        row = np.clip(np.floor((np.where(valid, latitude, 0) + 90) / self.cell_size), 0, self._rows - 1)
+        column = np.floor((np.where(valid, longitude, 0) + 180) / self.cell_size) % self._columns
+        return np.where(valid, row.astype(np.int64) * self._columns + column.astype(np.int64), -1)
+
+    def bounds(self, cell):
+        """(south, north, west, east) edges of a cell in degrees."""
+        row, column = divmod(int(cell), self._columns)
+        south = row * self.cell_size - 90
+        west = column * self.cell_size - 180
+        return south, min(south + self.cell_size, 90.0), west, min(west + self.cell_size, 180.0)
+
+    def describe(self):
+        return {'cell_size': self.cell_size, 'latitude': self.latitude, 'longitude': self.longitude}
+
+    @property
+    def columns(self):
+        return [self.latitude, self.longitude]
+
+    def __repr__(self):
+        return 'GridIndex({!r}, latitude={!r}, longitude={!r})'.format(self.cell_size, self.latitude, self.longitude)
+
+class RegionalModel():
+    """One polynomial model per grid cell, trained from per-cell statistics.
+
+    Rows are sorted by cell once and each cell's Gram statistics are
+    accumulated across a process pool over a shared-memory copy of the
+    rows (streaming datasets are read once in chunks). The cells' sum is
+    the global fit, which serves as the fallback for cells with fewer than
+    min_rows rows and for cells never seen in training. Predictions route
+    each row to its cell's model, so a batch from one station only
+    evaluates one small model.
+    """
+    def __init__(self, index=None, min_rows=None, workers=None):
+        self.index = index if index is not None else GridIndex()
+        self.min_rows = min_rows
+        self.workers = workers or os.cpu_count() or 1
+        self._target = None
+        self._features = None
+        self._degree = None
+        self._models = {}
+        self._fallback = None
+
+    def train(self, target, train_data, degree=2, write=None, chunk_size=250000, features=None):
+        if self._fallback is not None:
+            print("Warning: Existing regional models will be overwritten.")
+        missing = [c for c in self.index.columns if c not in train_data.columns]
+        if missing:
+            raise ValueError("Regional models need the {} columns to index rows.".format(missing))
+        self._target = [target]
+        self._features = list(features) if features is not None else [c for c in train_data.columns if c != target]
+        self._degree = degree
+        kernel = make_expansion(self._features, degree if degree is not None and degree >= 2 else 1,
+                                include_bias=degree is not None and degree >= 2)
+        kernel.fit(np.zeros((1, len(self._features))))
+        with stage("Accumulating regional statistics", write=write, degree=degree) as span:
+            if train_data.streaming:
+                stats = self._accumulate_chunks(train_data, kernel, chunk_size)
+            else:
+                stats = self._accumulate(train_data, kernel, chunk_size)
+            span.add(rows=sum(s.rows for s in stats.values()), regions=len(stats))
+        total = SufficientStats(kernel.n_output_features_)
+        for cell_stats in stats.values():
+            total += cell_stats
+        if total.rows == 0:
+            raise ValueError("No training data.")
+        min_rows = self.min_rows if self.min_rows is not None else 10 * kernel.n_output_features_
+        with stage("Solving regional models", write=write) as span:
+            self._fallback = self._solve(total, kernel)
+            self._models = dict((cell, self._solve(cell_stats, kernel)) for cell, cell_stats in sorted(stats.items())
+                                if cell >= 0 and cell_stats.rows >= min_rows)
+            span.add(regions=len(self._models), fallback_rows=total.rows - sum(stats[c].rows for c in self._models))
+        return self._score_chunks(train_data, chunk_size, 'train', write)
+
+    def _solve(self, stats, kernel):
+        coef, intercept = stats.solve()
+        model = Model()
+        model.restore(self._target[0], self._features, self._degree, coef, intercept, stats=stats, powers=kernel.powers_)
+        return model
+
+    def _accumulate(self, dataset, kernel, chunk_size):
+        # Rows are sorted by cell into one [X | y] block, so every task is a
+        # row range of a single cell; large cells are split across tasks.
+        # The block keeps the frame's dtype (float32 when compact) and is
+        # widened chunk by chunk in the workers.
+        data = dataset.array(self._features + self._target, dtype=None)
+        cells = self.index.cells(*dataset.array(self.index.columns, dtype=None).T)
+        order = np.argsort(cells, kind='stable')
+        labels, starts = np.unique(cells[order], return_index=True)
+        bounds = np.append(starts, len(cells))
+        workers = self.workers
+        step = max(chunk_size, -(-len(cells) // workers))
+        tasks, owners = [], []
+        for cell, start, stop in zip(labels, bounds[:-1], bounds[1:]):
+            for begin in range(start, stop, step):
+                tasks.append((begin, min(begin + step, stop), chunk_size))
+                owners.append(int(cell))
+        stats = {}
+        for cell, partial in zip(owners, accumulate_ranges(data, kernel, tasks, workers, order)):
+            if cell in stats:
+                stats[cell] += partial
+            else:
+                stats[cell] = partial
+        return stats
+
+    def _accumulate_chunks(self, dataset, kernel, chunk_size):
+        stats = {}
+        columns = self._features + self._target + [c for c in self.index.columns if c not in self._features]
+        for chunk in dataset.iter_chunks(chunk_size, columns):
+            X = chunk.loc[:, self._features].to_numpy(dtype=np.float64)
+            y = chunk[self._target[0]].to_numpy(dtype=np.float64)
+            cells = self.index.cells(chunk[self.index.latitude].to_numpy(), chunk[self.index.longitude].to_numpy())
+            order = np.argsort(cells, kind='stable')
+            labels, starts = np.unique(cells[order], return_index=True)
+            bounds = np.append(starts, len(cells))
+            X, y = X[order], y[order]
+            for cell, start, stop in zip(labels, bounds[:-1], bounds[1:]):
+                cell = int(cell)
+                if cell not in stats:
+                    stats[cell] = SufficientStats(kernel.n_output_features_)
+                accumulate(stats[cell], kernel, X[start:stop], y[start:stop])
+        return stats
+
+    def _score_chunks(self, dataset, chunk_size, label, write=None):
+        columns = self._features + self._target + [c for c in self.index.columns if c not in self._features]
+        with stage("Predicting and scoring {} data by region".format(label), write=write) as span:
+            metrics = RunningMetrics()
+            for chunk in dataset.iter_chunks(chunk_size, columns):
+                X = chunk.loc[:, self._features].to_numpy(dtype=np.float64)
+                metrics.update(chunk[self._target[0]].to_numpy(dtype=np.float64), self.predict(X, self.lookup(chunk)))
+                span.add(rows=len(chunk))
+        return metrics.results()
+
+    def test(self, test_data, write=None, chunk_size=250000):
+        return self._score_chunks(test_data, chunk_size, 'test', write)
+
+    def lookup(self, frame):
+        """Cells of the rows of a DataFrame (or dict of columns)."""
+        return self.index.cells(frame[self.index.latitude], frame[self.index.longitude])
+
+    def model(self, cell):
+        """The model that predicts rows of a cell."""
+        return self._models.get(int(cell), self._fallback)
+
+    def predict(self, X, cells=None, chunk_size=65536, n_jobs=1):
+        # cells may be omitted when latitude and longitude are features
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        if cells is None:
+            cells = self.index.cells(X[:, self._features.index(self.index.latitude)],
+                                     X[:, self._features.index(self.index.longitude)])
+        cells = np.asarray(cells).ravel()
+        if len(cells) and (cells == cells[0]).all():
+            return self.model(cells[0]).predict(X, chunk_size=chunk_size, n_jobs=n_jobs)
+        out = np.empty(X.shape[0])
+        order = np.argsort(cells, kind='stable')
+        labels, starts = np.unique(cells[order], return_index=True)
+        bounds = np.append(starts, len(cells))
+        for cell, start, stop in zip(labels, bounds[:-1], bounds[1:]):
+            rows = order[start:stop]
+            out[rows] = self.model(cell).predict(X[rows], chunk_size=chunk_size, n_jobs=n_jobs)
+        return out
+
+    def restore(self, fallback, models, min_rows=None):
+        self._fallback = fallback
+        self._models = dict((int(cell), model) for cell, model in models.items())
+        self._target = list(fallback.target)
+        self._features = list(fallback.features)
+        self._degree = fallback.degree
+        self.min_rows = min_rows
+
+    def describe(self):
+        return {'index': self.index.describe(), 'min_rows': self.min_rows,
+                'cells': dict((str(cell), {'rows': model.stats.rows if model.stats is not None else None,
+                                           'bounds': list(self.index.bounds(cell))})
+                              for cell, model in self._models.items())}
+
+    @property
+    def target(self):
+        return self._target
+
+    @property
+    def features(self):
+        return self._features
+
+    @property
+    def models(self):
+        return self._models
+
+    @property
+    def fallback(self):
+        return self._fallback
@@ -0,0 +1,47 @@
+import numpy as np
+
+class Downsample():
+    """Class-stratified sample on a binary column, e.g. Downsample('hail', 0.01)
+    keeps every hail row and about one in a hundred of the others.
+
+    Kept rows carry the importance weight 1/rate of their class, so weighted
+    fits and metrics estimate what the full table would give. Sampling is
+    seeded by (seed, key), so the same chunk of the same table always keeps
+    the same rows.
+    """
+    def __init__(self, column, negative_rate, positive_rate=1.0, seed=0):
+        for rate in (negative_rate, positive_rate):
+            if not 0 < rate <= 1:
+                raise ValueError("Sampling rates must be in (0, 1], got {}.".format(rate))
+        self.column = column
+        self.negative_rate = float(negative_rate)
+        self.positive_rate = float(positive_rate)
+        self.seed = seed
+
+    @classmethod
+    def coerce(cls, downsample):
+        """Downsample for a Dataset: None and Downsamples pass through, a
+        dict is used as keyword arguments and a tuple as positional ones."""
+        if downsample is None or isinstance(downsample, cls):
+            return downsample
+        if isinstance(downsample, dict):
+            return cls(**downsample)
+        return cls(*downsample)
+
+    def mask(self, data, key=0):
+        positive = data[self.column].to_numpy() != 0
+        rates = np.where(positive, self.positive_rate, self.negative_rate)
+        return np.random.default_rng([self.seed, key]).random(len(data)) < rates
+
+    def apply(self, data, key=0):
+        if len(data) == 0:
+            return data
+        return data.loc[self.mask(data, key)]
+
+    def weights(self, data):
+        positive = data[self.column].to_numpy() != 0
+        return np.where(positive, 1 / self.positive_rate, 1 / self.negative_rate)
+
+    def __repr__(self):
+        return 'Downsample({!r}, {!r}, positive_rate={!r}, seed={!r})'.format(self.column, self.negative_rate,
+                                                                             self.positive_rate, self.seed)
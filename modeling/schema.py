@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+
+# GSOD columns that only take the values 0 and 1
+FLAG_COLUMNS = ('fog', 'rain_drizzle', 'snow_ice_pellets', 'hail', 'thunder', 'tornado_funnel_cloud')
+# small integer columns and the narrowest type that holds them
+INTEGER_COLUMNS = {'mo': 'uint8', 'da': 'uint8', 'year': 'uint16'}
+MEASUREMENT_DTYPE = 'float32'
+# GSOD marks a missing reading with these values; every ingest path masks
+# them to nulls, so a row is only lost when a column it is loaded with is missing
+MISSING_VALUES = {'temp': 9999.9, 'dewp': 9999.9, 'slp': 9999.9, 'stp': 9999.9, 'visib': 999.9,
+                  'wdsp': 999.9, 'mxpsp': 999.9, 'gust': 999.9, 'max': 9999.9, 'min': 9999.9,
+                  'prcp': 99.99, 'sndp': 999.9}
+
+def load_dtypes(columns, compact=False):
+    """dtypes to read columns with: float64, or float32 in compact mode.
+    Either holds the NaNs that are dropped before compacting."""
+    return dict([(c, MEASUREMENT_DTYPE if compact else 'float64') for c in columns])
+
+def compact_dtype(column):
+    if column in FLAG_COLUMNS:
+        return 'uint8'
+    return INTEGER_COLUMNS.get(column, MEASUREMENT_DTYPE)
+
+def compact(data):
+    """Narrows each column of a NaN-free frame to its compact dtype: flags
+    and month as uint8, year as uint16, measurements as float32."""
+    dtypes = dict([(c, compact_dtype(c)) for c in data.columns if data[c].dtype != compact_dtype(c)])
+    if not dtypes:
+        return data
+    return data.astype(dtypes)
+
+class PackedFlags():
+    """Flag columns stored as bits, eight flags per byte per row."""
+    def __init__(self, data, columns):
+        self._columns = list(columns)
+        bits = np.empty((len(data), len(self._columns)), dtype=bool)
+        for i, c in enumerate(self._columns):
+            bits[:, i] = data[c].to_numpy() != 0
+        self._block = np.packbits(bits, axis=1, bitorder='little')
+
+    def column(self, name, start=None, stop=None, dtype='uint8'):
+        i = self._columns.index(name)
+        return ((self._block[start:stop, i // 8] >> (i % 8)) & 1).astype(dtype, copy=False)
+
+    def frame(self, start=None, stop=None):
+        return pd.DataFrame(dict((c, self.column(c, start, stop)) for c in self._columns))
+
+    def __len__(self):
+        return self._block.shape[0]
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    @property
+    def nbytes(self):
+        return self._block.nbytes
@@ -0,0 +1,234 @@
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+from array import array
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from . import PolyReg
+
+class LatencyStats():
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = array('d')
+        self._rows = 0
+        self._start = time.perf_counter()
+
+    def record(self, rows, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._rows += rows
+
+    def summary(self):
+        with self._lock:
+            latencies = np.frombuffer(self._latencies, dtype=np.float64).copy() if len(self._latencies) else np.zeros(1)
+            rows = self._rows
+            count = len(self._latencies)
+        elapsed = time.perf_counter() - self._start
+        return {'rows': rows, 'batches': count, 'seconds': elapsed,
+                'rows_per_second': rows / elapsed if elapsed > 0 else 0.0,
+                'p50_ms': float(np.percentile(latencies, 50) * 1000),
+                'p99_ms': float(np.percentile(latencies, 99) * 1000)}
+
+    def format(self):
+        summary = self.summary()
+        return "{rows} rows in {batches} batches, {seconds:.3f} s ({rows_per_second:.0f} rows/s), latency p50 {p50_ms:.3f} ms, p99 {p99_ms:.3f} ms".format(**summary)
+
+def load_model(model, models_dir=None):
+    if os.path.isdir(model):
+        pm = PolyReg.load_model_from_path_s(model)
+    else:
+        pm = PolyReg.load_model_from_id(model, dir=models_dir)
+    if pm is None or pm.model.model is None:
+        raise FileNotFoundError("Model '{}' not found.".format(model))
+    return pm
+
+def iter_batches(path, columns, batch_size):
+    if path.endswith('.parquet'):
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=batch_size, columns=columns):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(path, usecols=columns, chunksize=batch_size):
+            yield chunk
+
+class BatchWriter():
+    def __init__(self, path):
+        self.path = path
+        self._writer = None
+        self._header = True
+
+    def write(self, frame):
+        if self.path.endswith('.parquet'):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if self._writer is None:
+                self._writer = pq.ParquetWriter(self.path, table.schema, compression='zstd')
+            self._writer.write_table(table)
+        else:
+            frame.to_csv(self.path, mode='w' if self._header else 'a', header=self._header, index=False)
+            self._header = False
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+def score_file(pm, input_path, output_path, batch_size=65536, keep=(), n_jobs=1):
+    features = pm.model.features
+    prediction = '{}_predicted'.format(pm.target)
+    stats = LatencyStats()
+    writer = BatchWriter(output_path)
+    try:
+        for batch in iter_batches(input_path, list(dict.fromkeys(list(keep) + features)), batch_size):
+            start = time.perf_counter()
+            batch = batch.dropna(subset=features)
+            result = batch.loc[:, list(keep)].reset_index(drop=True)
+            result[prediction] = pm.predict(batch, n_jobs=n_jobs)
+            stats.record(len(batch), time.perf_counter() - start)
+            writer.write(result)
+    finally:
+        writer.close()
+    return stats
+
+class MicroBatcher():
+    """Collects concurrent prediction requests into one evaluator call.
+
+    The first queued request opens a batch; it is closed once max_rows are
+    gathered or max_wait seconds have passed, whichever comes first."""
+    def __init__(self, pm, max_rows=8192, max_wait=0.002):
+        self.pm = pm
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.batch_stats = LatencyStats()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, X):
+        future = Future()
+        self._queue.put((np.asarray(X, dtype=np.float64), future))
+        return future
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            rows = len(pending[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while rows < self.max_rows:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(item)
+                rows += len(item[0])
+            start = time.perf_counter()
+            try:
+                predictions = self.pm.predict(np.concatenate([X for X, _ in pending]))
+            except Exception as error:
+                for _, future in pending:
+                    future.set_exception(error)
+                continue
+            self.batch_stats.record(rows, time.perf_counter() - start)
+            offset = 0
+            for X, future in pending:
+                future.set_result(predictions[offset:offset + len(X)])
+                offset += len(X)
+
+def make_handler(batcher, request_stats):
+    features = batcher.pm.model.features
+
+    class ScoreHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != '/stats':
+                self._reply(404, {'error': 'not found'})
+                return
+            self._reply(200, {'requests': request_stats.summary(), 'batches': batcher.batch_stats.summary()})
+
+        def do_POST(self):
+            if self.path != '/predict':
+                self._reply(404, {'error': 'not found'})
+                return
+            start = time.perf_counter()
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if 'columns' in body:
+                    X = np.column_stack([np.asarray(body['columns'][f], dtype=np.float64) for f in features])
+                else:
+                    X = np.array([[row[f] for f in features] for row in body['rows']], dtype=np.float64).reshape(-1, len(features))
+            except (ValueError, KeyError, TypeError) as error:
+                self._reply(400, {'error': 'bad request: {}'.format(error), 'features': features})
+                return
+            try:
+                predictions = batcher.submit(X).result()
+            except Exception as error:
+                # the batch failed (e.g. a row the model cannot score); the
+                # server keeps running and the client gets the reason
+                self._reply(500, {'error': 'prediction failed: {}'.format(error)})
+                return
+            request_stats.record(len(X), time.perf_counter() - start)
+            self._reply(200, {'predictions': predictions.tolist()})
+
+        def _reply(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return ScoreHandler
+
+class ScoreServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def serve(pm, host='127.0.0.1', port=8080, max_rows=8192, max_wait=0.002):
+    batcher = MicroBatcher(pm, max_rows=max_rows, max_wait=max_wait)
+    request_stats = LatencyStats()
+    server = ScoreServer((host, port), make_handler(batcher, request_stats))
+    print("Serving {} on http://{}:{}/predict (stats at /stats)".format(pm.target, host, server.server_address[1]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("  --> Requests: {}".format(request_stats.format()))
+        print("  --> Batches: {}".format(batcher.batch_stats.format()))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m modeling', description='Score saved PolyReg models.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    score_parser = commands.add_parser('score', help='score a CSV or Parquet file in batches')
+    score_parser.add_argument('--model', required=True, help='model id under modeling/models/ or a model directory')
+    score_parser.add_argument('--models-dir', default=None)
+    score_parser.add_argument('--input', required=True, help='.csv or .parquet input file')
+    score_parser.add_argument('--output', required=True, help='.csv or .parquet output file')
+    score_parser.add_argument('--batch-size', type=int, default=65536)
+    score_parser.add_argument('--keep', nargs='*', default=[], help='input columns copied to the output')
+    score_parser.add_argument('--jobs', type=int, default=1, help='threads per batch')
+    serve_parser = commands.add_parser('serve', help='serve predictions over local HTTP')
+    serve_parser.add_argument('--model', required=True, help='model id under modeling/models/ or a model directory')
+    serve_parser.add_argument('--models-dir', default=None)
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=8080)
+    serve_parser.add_argument('--max-batch', type=int, default=8192, help='rows per micro-batch')
+    serve_parser.add_argument('--max-wait-ms', type=float, default=2.0, help='time a micro-batch waits to fill')
+    args = parser.parse_args(argv)
+
+    pm = load_model(args.model, args.models_dir)
+    if args.command == 'score':
+        stats = score_file(pm, args.input, args.output, batch_size=args.batch_size, keep=args.keep, n_jobs=args.jobs)
+        print("  --> Scored {}".format(stats.format()))
+    else:
+        serve(pm, host=args.host, port=args.port, max_rows=args.max_batch, max_wait=args.max_wait_ms / 1000)
@@ -0,0 +1,73 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from google.cloud import bigquery_storage_v1beta1
+from .filters import Filter
+
+class LocalSource():
+    """Offline stand-in for BigQuery: serves each table from a local
+    <table_name>.parquet or <table_name>.csv file in one directory."""
+    def __init__(self, directory):
+        self.directory = directory
+
+    @property
+    def identity(self):
+        return 'local:{}'.format(os.path.abspath(self.directory))
+
+    def path(self, table_name):
+        for ext in ('.parquet', '.csv'):
+            path = os.path.join(self.directory, table_name + ext)
+            if os.path.exists(path):
+                return path
+        raise FileNotFoundError("No local file for table '{}' in {}".format(table_name, self.directory))
+
+    def fetch(self, table_name, columns, max_rows=None, where=None):
+        path = self.path(table_name)
+        if path.endswith('.parquet'):
+            table = pq.read_table(path, columns=columns, memory_map=True, filters=where.to_arrow() if where is not None else None)
+            if max_rows is not None:
+                table = table.slice(0, max_rows)
+            return table.to_pandas()
+        if where is None:
+            data = pd.read_csv(path, usecols=columns, nrows=max_rows)
+            return data[columns] if columns is not None else data
+        usecols = list(dict.fromkeys(list(columns) + where.columns)) if columns is not None else None
+        data = pd.read_csv(path, usecols=usecols)
+        data = data.loc[where.mask(data)]
+        data = data[columns] if columns is not None else data
+        return data.iloc[:max_rows] if max_rows is not None else data
+
+class LocalStorageClient():
+    """Fake BigQueryStorageClient that splits a LocalSource table into
+    contiguous row ranges and serves each one as a read stream."""
+    def __init__(self, source):
+        self.source = LocalSource(source) if isinstance(source, str) else source
+        self._sessions = {}
+
+    @property
+    def identity(self):
+        return 'storage:{}'.format(self.source.identity)
+
+    def create_read_session(self, table_reference, parent, read_options=None, requested_streams=None, format_=None, **kwargs):
+        columns = list(read_options.selected_fields) if read_options is not None and len(read_options.selected_fields) else None
+        where = Filter.from_sql(read_options.row_restriction) if read_options is not None and read_options.row_restriction else None
+        data = self.source.fetch(table_reference.table_id, columns, where=where)
+        count = min(requested_streams or 1, len(data))
+        name = '{}/sessions/{}'.format(parent, len(self._sessions))
+        self._sessions[name] = (data, np.linspace(0, len(data), count + 1).astype(int))
+        streams = [bigquery_storage_v1beta1.types.Stream(name='{}/streams/{}'.format(name, i)) for i in range(count)]
+        return bigquery_storage_v1beta1.types.ReadSession(name=name, streams=streams)
+
+    def read_rows(self, position, **kwargs):
+        session, _, index = position.stream.name.rpartition('/streams/')
+        data, bounds = self._sessions[session]
+        index = int(index)
+        return LocalStreamReader(data.iloc[bounds[index] + position.offset:bounds[index + 1]])
+
+class LocalStreamReader():
+    def __init__(self, data):
+        self._data = data
+
+    def to_dataframe(self, session, dtypes=None):
+        return self._data.astype(dtypes) if dtypes else self._data.copy()
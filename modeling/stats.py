@@ -0,0 +1,180 @@
+import numpy as np
+from scipy import linalg
+
+class SufficientStats():
+    """Streaming sufficient statistics for least squares.
+
+    Keeps the (weighted) row count, the column means and the centered
+    co-moment matrix of [X, y], merged chunk by chunk with the pairwise
+    update of Chan et al., so memory is O(p^2) regardless of row count.
+    """
+    def __init__(self, n_terms):
+        self._n_terms = n_terms
+        self._rows = 0
+        self._weight = 0.0
+        self._mean = np.zeros(n_terms + 1)
+        self._comoment = np.zeros((n_terms + 1, n_terms + 1))
+
+    def copy(self):
+        other = SufficientStats(self._n_terms)
+        other._rows = self._rows
+        other._weight = self._weight
+        other._mean = self._mean.copy()
+        other._comoment = self._comoment.copy()
+        return other
+
+    def update(self, X, y, weights=None):
+        X = np.asarray(X, dtype=np.float64)
+        rows = X.shape[0]
+        if rows == 0:
+            return self
+        Z = np.empty((rows, self._n_terms + 1))
+        Z[:, :-1] = X
+        Z[:, -1] = np.asarray(y, dtype=np.float64).ravel()
+        if weights is None:
+            weight = float(rows)
+            mean = Z.mean(axis=0)
+            Z -= mean
+            comoment = Z.T @ Z
+        else:
+            weights = np.asarray(weights, dtype=np.float64).ravel()
+            weight = weights.sum()
+            mean = weights @ Z / weight
+            Z -= mean
+            comoment = (Z * weights[:, None]).T @ Z
+        self._combine(rows, weight, mean, comoment, 1)
+        return self
+
+    def update_moments(self, rows, weight, mean, comoment):
+        """Merges a chunk summarized elsewhere (e.g. by a sparse expansion)
+        as its row count, weight, column means and centered co-moments."""
+        if rows:
+            self._combine(rows, weight, np.asarray(mean, dtype=np.float64), np.asarray(comoment, dtype=np.float64), 1)
+        return self
+
+    def _combine(self, rows, weight, mean, comoment, sign):
+        if sign > 0:
+            total = self._weight + weight
+            if total == 0:
+                return
+            delta = mean - self._mean
+            self._comoment += comoment + np.outer(delta, delta) * (self._weight * weight / total)
+            self._mean += delta * (weight / total)
+        else:
+            total = self._weight - weight
+            if total <= 0:
+                self.__init__(self._n_terms)
+                return
+            remaining = (self._weight * self._mean - weight * mean) / total
+            delta = mean - remaining
+            self._comoment -= comoment + np.outer(delta, delta) * (total * weight / self._weight)
+            self._mean = remaining
+        self._rows += sign * rows
+        self._weight = total
+
+    def __iadd__(self, other):
+        self._combine(other._rows, other._weight, other._mean, other._comoment, 1)
+        return self
+
+    def __isub__(self, other):
+        self._combine(other._rows, other._weight, other._mean, other._comoment, -1)
+        return self
+
+    def __add__(self, other):
+        result = self.copy()
+        result += other
+        return result
+
+    def __sub__(self, other):
+        result = self.copy()
+        result -= other
+        return result
+
+    def solve(self, ridge=0.0, terms=None, rcond=1e-12):
+        """Solve the normal equations for (coef, intercept).
+
+        The centered Gram matrix is scaled to unit diagonal and factored
+        with Cholesky; rank-deficient systems (e.g. duplicated 0/1 terms)
+        fall back to the minimum-norm solution like LinearRegression.
+        Terms with zero variance, such as the polynomial bias column,
+        get a zero coefficient.
+        """
+        if terms is None:
+            terms = np.arange(self._n_terms)
+        terms = np.asarray(terms)
+        gram = self._comoment[np.ix_(terms, terms)]
+        moment = self._comoment[terms, -1]
+        scale = np.sqrt(np.diag(gram))
+        live = scale > 0
+        coef = np.zeros(len(terms))
+        if live.any():
+            s = scale[live]
+            gram_s = gram[np.ix_(live, live)] / np.outer(s, s)
+            moment_s = moment[live] / s
+            if ridge:
+                gram_s = gram_s + np.diag(ridge / (s * s))
+            try:
+                factor = linalg.cho_factor(gram_s)
+                diag = np.diag(factor[0])
+                if (diag.min() / diag.max()) ** 2 < rcond:
+                    raise linalg.LinAlgError("Gram matrix is rank deficient")
+                coef_s = linalg.cho_solve(factor, moment_s)
+            except linalg.LinAlgError:
+                coef_s = linalg.pinvh(gram_s, rtol=rcond) @ moment_s
+            coef[live] = coef_s / s
+        intercept = self._mean[-1] - self._mean[terms] @ coef
+        return coef, intercept
+
+    def save(self, path):
+        np.savez(path, n_terms=self._n_terms, rows=self._rows, weight=self._weight,
+                 mean=self._mean, comoment=self._comoment)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            stats = cls(int(arrays['n_terms']))
+            stats._rows = int(arrays['rows'])
+            stats._weight = float(arrays['weight'])
+            stats._mean = arrays['mean'].copy()
+            stats._comoment = arrays['comoment'].copy()
+        return stats
+
+    def score(self, coef, intercept, terms=None):
+        """R^2, explained variance and RMSE of a fitted model on the rows
+        summarized here, from the co-moments alone (so held-out rows need
+        not be read again). MAE cannot be recovered from second moments.
+        """
+        if terms is None:
+            terms = np.arange(self._n_terms)
+        terms = np.asarray(terms)
+        coef = np.asarray(coef, dtype=np.float64)
+        cxx = self._comoment[np.ix_(terms, terms)]
+        cxy = self._comoment[terms, -1]
+        cyy = self._comoment[-1, -1]
+        # squared residuals around their mean, plus the residual mean's share
+        centered = max(cyy - 2 * coef @ cxy + coef @ cxx @ coef, 0.0)
+        bias = self._mean[-1] - intercept - self._mean[terms] @ coef
+        sse = centered + self._weight * bias ** 2
+        return {'R-Squared': float(1 - sse / cyy) if cyy > 0 else 0.0,
+                'Explained Variance': float(1 - centered / cyy) if cyy > 0 else 0.0,
+                'Root Mean Squared Error': float(np.sqrt(sse / self._weight)) if self._weight > 0 else 0.0}
+
+    @property
+    def n_terms(self):
+        return self._n_terms
+
+    @property
+    def rows(self):
+        return self._rows
+
+    @property
+    def weight(self):
+        return self._weight
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def comoment(self):
+        return self._comoment
@@ -0,0 +1,144 @@
+import argparse
+import itertools
+import os
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from .dataset import Dataset
+from .model import Model
+from .stats import SufficientStats
+from .expansion import make_expansion, accumulate, accumulate_ranges
+from .instrument import stage
+
+def term_powers(features, degree):
+    return make_expansion(features, degree).fit(np.zeros((1, len(features)))).powers_
+
+class Sweep():
+    """Grid search over polynomial degree, feature subset and ridge penalty.
+
+    The data is expanded once to every term of max_degree and summarized as
+    SufficientStats; a configuration's terms are a subset of those, so each
+    one is solved from its block of the shared Gram matrix without touching
+    the rows again. In-memory rows are put in shared memory and accumulated
+    across a process pool; streaming datasets are read once in chunks.
+    """
+    def __init__(self, train_data, target, max_degree=3, features=None, test_data=None, workers=None, chunk_size=None):
+        self.target = target
+        self.max_degree = max_degree
+        self.features = list(features) if features is not None else [c for c in train_data.columns if c != target]
+        self.workers = workers or os.cpu_count() or 1
+        self.kernel = make_expansion(self.features, max_degree).fit(np.zeros((1, len(self.features))))
+        self.powers = self.kernel.powers_
+        # keep each expanded chunk around 128 MiB
+        self.chunk_size = chunk_size or max(1024, 2**24 // len(self.powers))
+        self.train_stats = self._statistics(train_data, 'train')
+        self.test_stats = self._statistics(test_data, 'test') if test_data is not None else None
+
+    def _statistics(self, dataset, label):
+        with stage("Accumulating {} Gram matrix".format(label), terms=len(self.powers)) as span:
+            if dataset.streaming:
+                stats = SufficientStats(len(self.powers))
+                for X, y in dataset.iter_arrays(self.features, [self.target], self.chunk_size, dtype=None):
+                    accumulate(stats, self.kernel, np.asarray(X, dtype=np.float64), y)
+            else:
+                # compact frames stay compact; chunks are widened in the workers
+                stats = self._accumulate(dataset.array(self.features + [self.target], dtype=None))
+            span.add(rows=stats.rows)
+        return stats
+
+    def _accumulate(self, data):
+        rows = data.shape[0]
+        workers = max(1, min(self.workers, -(-rows // self.chunk_size)))
+        step = -(-rows // workers) if rows else 0
+        tasks = [(start, min(start + step, rows), self.chunk_size) for start in range(0, rows, step)] if rows else []
+        stats = SufficientStats(len(self.powers))
+        for partial in accumulate_ranges(data, self.kernel, tasks, workers):
+            stats += partial
+        return stats
+
+    def terms(self, features, degree):
+        """Indices of the max_degree terms that make up a configuration."""
+        unused = [i for i, f in enumerate(self.features) if f not in features]
+        missing = [f for f in features if f not in self.features]
+        if missing:
+            raise ValueError("Features {} were not swept.".format(missing))
+        if degree > self.max_degree:
+            raise ValueError("Degree {} is above the sweep's max_degree {}.".format(degree, self.max_degree))
+        total = self.powers.sum(axis=1)
+        keep = (total > 0) & (total <= degree) & (self.powers[:, unused].sum(axis=1) == 0)
+        return np.flatnonzero(keep)
+
+    def evaluate(self, features, degree, ridge=0.0):
+        terms = self.terms(features, degree)
+        coef, intercept = self.train_stats.solve(ridge=ridge, terms=terms)
+        result = {'degree': degree, 'features': ','.join(features), 'ridge': ridge, 'terms': len(terms)}
+        for name, value in self.train_stats.score(coef, intercept, terms).items():
+            result['train ' + name] = value
+        if self.test_stats is not None:
+            for name, value in self.test_stats.score(coef, intercept, terms).items():
+                result['test ' + name] = value
+        return result
+
+    def run(self, degrees=(1, 2, 3), feature_sets=None, ridges=(0.0,)):
+        """Evaluates every (degree, features, ridge) combination and returns
+        them ranked by test RMSE (train RMSE without test data)."""
+        feature_sets = [self.features] if feature_sets is None else [list(f) for f in feature_sets]
+        grid = list(itertools.product(degrees, feature_sets, ridges))
+        with stage("Solving configurations", rows=len(grid)):
+            # the solves are LAPACK calls that release the GIL
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                results = list(pool.map(lambda config: self.evaluate(config[1], config[0], config[2]), grid))
+        metric = ('test ' if self.test_stats is not None else 'train ') + 'Root Mean Squared Error'
+        table = pd.DataFrame(results).sort_values([metric, 'terms'], kind='stable').reset_index(drop=True)
+        table.index = pd.RangeIndex(1, len(table) + 1, name='rank')
+        return table
+
+    def model(self, features, degree, ridge=0.0):
+        """A Model fitted with one configuration, ready to test or save."""
+        terms = self.terms(features, degree)
+        coef, intercept = self.train_stats.solve(ridge=ridge, terms=terms)
+        lookup = dict((tuple(self.powers[t, [self.features.index(f) for f in features]]), c) for t, c in zip(terms, coef))
+        model_powers = term_powers(features, degree) if degree >= 2 else np.eye(len(features), dtype=np.int64)
+        model = Model()
+        model.restore(self.target, features, degree, [lookup.get(tuple(p), 0.0) for p in model_powers], intercept)
+        return model
+
+def sweep(train_data, target, degrees=(1, 2, 3), feature_sets=None, ridges=(0.0,), test_data=None, workers=None):
+    features = None
+    if feature_sets is not None:
+        features = sorted(set(itertools.chain.from_iterable(feature_sets)), key=lambda f: list(train_data.columns).index(f))
+    return Sweep(train_data, target, max(degrees), features, test_data, workers).run(degrees, feature_sets, ridges)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m modeling sweep', description='Sweep polynomial degree, feature subsets and ridge penalties.')
+    parser.add_argument('--target', default='temp')
+    parser.add_argument('--columns', nargs='+', default=['mo', 'temp', 'dewp', 'slp', 'stp', 'visib', 'wdsp', 'altitude', 'longitude', 'latitude', 'prcp'])
+    parser.add_argument('--degrees', type=int, nargs='+', default=[1, 2, 3])
+    parser.add_argument('--features', nargs='+', default=None, help='comma-separated feature subsets, e.g. mo,dewp mo,dewp,slp (default all columns)')
+    parser.add_argument('--ridge', type=float, nargs='+', default=[0.0])
+    parser.add_argument('--source', default=None, help='directory of train/test Parquet or CSV files (default BigQuery)')
+    parser.add_argument('--train-shards', default=None)
+    parser.add_argument('--test-shards', default=None)
+    parser.add_argument('--max-rows', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--output', default=None, help='write the ranked table to this CSV file')
+    args = parser.parse_args(argv)
+
+    source = None
+    if args.source is not None:
+        from .sources import LocalSource
+        source = LocalSource(args.source)
+    if args.train_shards is not None:
+        train_data = Dataset(columns=args.columns, shards=args.train_shards)
+    else:
+        train_data = Dataset(columns=args.columns, max_size=args.max_rows, source=source)
+    if args.test_shards is not None:
+        test_data = Dataset('test', columns=args.columns, shards=args.test_shards)
+    else:
+        test_data = Dataset('test', columns=args.columns, max_size=args.max_rows // 5 if args.max_rows else None, source=source)
+    feature_sets = [f.split(',') for f in args.features] if args.features is not None else None
+    table = sweep(train_data, args.target, args.degrees, feature_sets, args.ridge, test_data, args.workers)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.max_colwidth', 60):
+        print(table.to_string())
+    if args.output is not None:
+        table.to_csv(args.output)
@@ -1,2 +1,2 @@
-from .calculateLinearModels import CalculateLinearModels
+from .calculateLinearModels import CalculateLinearModels, TopModels
 from . import modeltest
\ No newline at end of file
@@ -1,29 +1,96 @@
 from google.cloud import bigquery
-from functools import reduce
 
+import argparse
+import os.path
+import sys
 
-def get_cleaned_table(year, columns=("stn","year","mo","da","temp", "dewp", "slp", "stp", "wdsp", "hail"),max_rows=1000000):
-    client = bigquery.Client()
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
 
-    gsod_dataset_ref = client.dataset('noaa_gsod', project='bigquery-public-data')
+from modeling.schema import MISSING_VALUES
 
-    gsod_dset = client.get_dataset(gsod_dataset_ref)
+COLUMNS = ("stn","year","mo","da","temp", "dewp", "slp", "stp", "wdsp", "hail")
 
-    gsod_full = client.get_table(gsod_dset.table(f'gsod{year}'))
 
-    schema_subset = [col for col in gsod_full.schema if col.name in columns]
-    return  [x for x in client.list_rows(gsod_full, start_index=0, selected_fields=schema_subset, max_results=min((gsod_full.num_rows,max_rows))) 
-                     if x.temp != 9999.9 and x.dewp != 9999.9 and x.slp != 9999.9 and x.stp != 9999.9 and x.wdsp != 999.9]
+class BigQueryRowSource():
+    def __init__(self, client=None):
+        self.client = client or bigquery.Client()
 
+    def iter_frames(self, year, columns, max_rows):
+        gsod_dataset_ref = self.client.dataset('noaa_gsod', project='bigquery-public-data')
+        gsod_dset = self.client.get_dataset(gsod_dataset_ref)
+        gsod_full = self.client.get_table(gsod_dset.table(f'gsod{year}'))
 
-results = get_cleaned_table(1997,max_rows=2000000)
+        schema_subset = [col for col in gsod_full.schema if col.name in columns]
+        rows = self.client.list_rows(gsod_full, start_index=0, selected_fields=schema_subset,
+                                     max_results=min((gsod_full.num_rows,max_rows)))
+        return rows.to_dataframe_iterable()
 
-num_results = len(results)
-num_hail = reduce(lambda acc,x2: acc + int(x2.hail), results,0)
-num_nohail = len(results) - num_hail
+class LocalRowSource():
+    """Reads gsod<year>.parquet or gsod<year>.csv from a directory in
+    batches, in place of the BigQuery table."""
+    def __init__(self, directory, batch_size=65536):
+        self.directory = directory
+        self.batch_size = batch_size
 
-print("stn","year","mo","da","temp", "dewp", "slp", "stp", "wdsp", "hail")
-for row in results:
-    print(row.stn, row.year, row.mo, row.da, row.temp, row.dewp, row.slp, row.stp, row.wdsp, row.hail)
+    def iter_frames(self, year, columns, max_rows):
+        path = os.path.join(self.directory, f'gsod{year}')
+        if os.path.exists(path + '.parquet'):
+            frames = (batch.to_pandas() for batch in pq.ParquetFile(path + '.parquet').iter_batches(batch_size=self.batch_size, columns=list(columns)))
+        else:
+            frames = pd.read_csv(path + '.csv', usecols=list(columns), chunksize=self.batch_size)
+        remaining = max_rows
+        for frame in frames:
+            if remaining <= 0:
+                return
+            yield frame.iloc[:remaining]
+            remaining -= len(frame)
 
-print(f"Entries (No Hail/Hail): {num_results} ({num_nohail}/{num_hail})")
\ No newline at end of file
+def get_cleaned_table(year, columns=COLUMNS, max_rows=1000000, source=None):
+    source = source or BigQueryRowSource()
+    for frame in source.iter_frames(year, columns, max_rows):
+        keep = np.ones(len(frame), dtype=bool)
+        # rows missing any of the selected readings are skipped
+        for col, sentinel in MISSING_VALUES.items():
+            if col in frame.columns:
+                keep &= (frame[col] != sentinel).to_numpy(dtype=bool, na_value=True)
+        yield frame.loc[keep, list(columns)]
+
+class HailCounts():
+    def __init__(self):
+        self.entries = 0
+        self.hail = 0
+
+    def update(self, frame):
+        self.entries += len(frame)
+        self.hail += int(frame['hail'].astype(int).sum())
+
+    @property
+    def no_hail(self):
+        return self.entries - self.hail
+
+def main(year=1997, max_rows=2000000, output=None, source=None, columns=COLUMNS):
+    counts = HailCounts()
+    out = open(output, 'w') if output is not None else sys.stdout
+    try:
+        print(*columns, file=out)
+        for frame in get_cleaned_table(year, columns=columns, max_rows=max_rows, source=source):
+            counts.update(frame)
+            frame.to_csv(out, sep=' ', header=False, index=False)
+    finally:
+        if output is not None:
+            out.close()
+
+    print(f"Entries (No Hail/Hail): {counts.entries} ({counts.no_hail}/{counts.hail})")
+    return counts
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Stream a cleaned GSOD year and count hail days.')
+    parser.add_argument('year', type=int, nargs='?', default=1997)
+    parser.add_argument('--max-rows', type=int, default=2000000)
+    parser.add_argument('--output', default=None, help='write rows here instead of stdout')
+    parser.add_argument('--local', default=None, help='read gsod<year>.parquet/.csv from this directory instead of BigQuery')
+    args = parser.parse_args()
+
+    main(args.year, args.max_rows, args.output, LocalRowSource(args.local) if args.local else None)
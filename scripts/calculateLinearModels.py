@@ -3,7 +3,176 @@ import numpy as np
 import statsmodels.api as sm
 import matplotlib.pyplot as plt
 import itertools
+import heapq
 import time
+from array import array
+from modeling.parallel import map_shared
+
+class _RankedModel:
+    """Heap entry ordered so that heapq's smallest item is the worst model."""
+    __slots__ = ('RSS', 'featureSet', 'model')
+
+    def __init__(self, RSS, featureSet, model):
+        self.RSS = RSS
+        self.featureSet = featureSet
+        self.model = model
+
+    def __lt__(self, other):
+        return (self.RSS, self.featureSet) > (other.RSS, other.featureSet)
+
+
+class TopModels:
+    """Streaming selector that keeps the numModels lowest-RSS models.
+
+    Models are pushed as they are generated; anything that does not make
+    the cut is dropped immediately, so memory stays flat no matter how
+    many subsets are searched. Ties on RSS are broken by the feature
+    tuple, which makes the selection independent of generation order.
+    The RSS and size of every pushed model are kept in compact arrays for
+    plotting the full distribution.
+
+    Arguments:
+        numModels: An integer that sets the number of models to keep."""
+
+    def __init__(self, numModels):
+        self._numModels = numModels
+        self._heap = []
+        self._RSS = array('d')
+        self._sizes = array('H')
+
+    def push(self, RSS, featureSet, model=None):
+        """Offers a model to the selector.
+
+        Args:
+            RSS: The residual sum of squares of the model.
+            featureSet: The tuple of features in the model.
+            model: An optional fitted statsmodels result to keep with it."""
+        RSS = float(RSS)
+        self._RSS.append(RSS)
+        self._sizes.append(len(featureSet))
+        if self._numModels <= 0:
+            return
+        entry = _RankedModel(RSS, tuple(featureSet), model)
+        if len(self._heap) < self._numModels:
+            heapq.heappush(self._heap, entry)
+        elif self._heap[0] < entry:
+            heapq.heapreplace(self._heap, entry)
+
+    def merge(self, other):
+        """Folds another selector's kept models and distribution into this one."""
+        for entry in other._heap:
+            if len(self._heap) < self._numModels:
+                heapq.heappush(self._heap, entry)
+            elif self._heap[0] < entry:
+                heapq.heapreplace(self._heap, entry)
+        self._RSS.extend(other._RSS)
+        self._sizes.extend(other._sizes)
+
+    def best(self):
+        """Returns the kept models as [model, RSS, featureSet] lists, best first."""
+        return [[entry.model, entry.RSS, entry.featureSet] for entry in sorted(self._heap, reverse=True)]
+
+    def distribution(self):
+        """Returns the number of features and the RSS of every model pushed,
+        as numpy arrays in generation order."""
+        return np.frombuffer(self._sizes, dtype=np.uint16), np.frombuffer(self._RSS, dtype=np.float64)
+
+    def __len__(self):
+        return len(self._RSS)
+
+
+# Per-process state for subset search tasks, filled in by _initWorker in
+# the parent (workers=1) or in every pool process of map_shared.
+_worker = {}
+
+
+def _initWorker(data, features, maxFeatures, numModels, engine, gram, moment, outcomeSquares):
+    """Attaches a worker to the [X | y] block and the search settings."""
+    _worker.update(X=data[:, :-1], y=data[:, -1], features=features, maxFeatures=maxFeatures,
+                   numModels=numModels, engine=engine, gram=gram, moment=moment,
+                   outcomeSquares=outcomeSquares, tolerance=None if gram is None else 1e-10 * np.diag(gram))
+
+
+def _subsetTasks(numFeatures, maxFeatures):
+    """Shards the subset space into tasks of (prefix, maxSize).
+
+    A task covers every subset of at most maxSize features whose smallest
+    indices are the prefix. One task scores the single features and one
+    task per feature pair covers that pair and all of its supersets."""
+    tasks = [((), 1)]
+    if maxFeatures >= 2:
+        tasks += [(pair, maxFeatures) for pair in itertools.combinations(range(numFeatures), 2)]
+    return tasks
+
+
+def _extendSubset(W, z, RSS, j):
+    """Adds feature j to a subset's Cholesky state; see _searchGram."""
+    gram, moment, tolerance = _worker['gram'], _worker['moment'], _worker['tolerance']
+    pivot = gram[j, j] - W[:, j] @ W[:, j]
+    if pivot <= tolerance[j]:
+        return W, z, RSS
+    d = np.sqrt(pivot)
+    step = (moment[j] - W[:, j] @ z) / d
+    return np.vstack([W, (gram[j] - W[:, j] @ W) / d]), np.append(z, step), RSS - step ** 2
+
+
+def _searchGram(start, W, z, RSS, combination, maxSize, top):
+    """Scores every superset of a subset from the Gram matrix.
+
+    Subsets are walked depth first, each child adding one feature with a
+    larger index than its parent. For a node with Cholesky factor L of its
+    Gram block, W = L^-1 X_S'X and z = L^-1 X_S'y give every child's new
+    pivot and RSS in one vectorized step:
+
+        d_j^2 = G_jj - |W_j|^2,  z_j = (b_j - W_j.z) / d_j,
+        RSS(S + j) = RSS(S) - z_j^2
+
+    Features that are collinear with the subset (d_j ~ 0) leave the RSS
+    unchanged, matching the pseudo-inverse fit statsmodels uses."""
+    gram, moment, tolerance = _worker['gram'], _worker['moment'], _worker['tolerance']
+    features = _worker['features']
+    candidates = np.arange(start, len(features))
+    if len(candidates) == 0 or len(combination) >= maxSize:
+        return
+    pivots = np.diag(gram)[candidates] - (W[:, candidates] ** 2).sum(axis=0)
+    independent = pivots > tolerance[candidates]
+    d = np.sqrt(np.where(independent, pivots, 1.0))
+    steps = np.where(independent, (moment[candidates] - W[:, candidates].T @ z) / d, 0.0)
+    childRSS = RSS - steps ** 2
+    for j, step, pivot, independent_j, childRSS_j in zip(candidates, steps, d, independent, childRSS):
+        childCombination = combination + (j,)
+        top.push(childRSS_j, tuple(features[i] for i in childCombination))
+        if len(childCombination) < maxSize:
+            if independent_j:
+                row = (gram[j] - W[:, j] @ W) / pivot
+                _searchGram(j + 1, np.vstack([W, row]), np.append(z, step), childRSS_j, childCombination, maxSize, top)
+            else:
+                _searchGram(j + 1, W, z, childRSS_j, childCombination, maxSize, top)
+
+
+def _runTask(task):
+    """Scores one shard of the subset space and returns its TopModels."""
+    prefix, maxSize = task
+    features = _worker['features']
+    top = TopModels(_worker['numModels'])
+    start = prefix[-1] + 1 if prefix else 0
+    if _worker['engine'] == 'gram':
+        W, z, RSS = np.zeros((0, len(features))), np.zeros(0), _worker['outcomeSquares']
+        for j in prefix:
+            W, z, RSS = _extendSubset(W, z, RSS, j)
+        if prefix:
+            top.push(RSS, tuple(features[i] for i in prefix))
+        _searchGram(start, W, z, RSS, prefix, maxSize, top)
+    else:
+        X, y = _worker['X'], _worker['y']
+        for size in range(0, maxSize - len(prefix) + 1):
+            for rest in itertools.combinations(range(start, len(features)), size):
+                combination = prefix + rest
+                if combination:
+                    regressionModel = sm.OLS(y, X[:, list(combination)]).fit()
+                    top.push(regressionModel.ssr, tuple(features[i] for i in combination))
+    return top
+
 
 class CalculateLinearModels:
     """The CalculateLinearModels class will employ exhaustive search to
@@ -37,21 +206,30 @@ class CalculateLinearModels:
             all the models.
         outcomeName: A string of the name of the column in the dataset 
             that is being predicted.
+        engine: Either 'gram' (default) or 'statsmodels'. The gram engine
+            computes X'X and X'y once and scores every subset from them
+            with incremental Cholesky updates; only the kept models are
+            refit with statsmodels, and only when they are summarized.
+            The statsmodels engine fits every subset with sm.OLS.
+        workers: An integer that sets the number of processes the subset
+            search is sharded across. The feature matrix is shared with
+            the processes through shared memory, and the results do not
+            depend on the number of workers.
             
     Inspired from: http://www.science.smith.edu/~jcrouser/SDS293/labs/lab8-py.html"""
     
-    def __init__(self, fileName, maxFeatures, numModels, outcomeName):
+    def __init__(self, fileName, maxFeatures, numModels, outcomeName, engine='gram', workers=1):
         """Initializes CalculateLinearModels, including reading in data.
         
         Raises:
             IOError: The data file has missing or invalid information.
             ValueError: The outcome name given is not a column in the
-                data file."""
+                data file, or the engine is unknown."""
         self._maxFeatures = maxFeatures
         self._numModels = numModels
         self._nameOutcome = outcomeName
 
-        self._listModels = []
+        self._topModels = TopModels(self._numModels)
         self._listBestModels = []
 
         self._dataframe = pd.read_csv(fileName)
@@ -59,9 +237,8 @@ class CalculateLinearModels:
 
         # Ensure that the data frame holds no non-numeric values,
         # raise exception otherwise.
-        numericFeatures = self._dataframe.applymap(np.isreal).all()
-        for numericFeature in numericFeatures:
-            if(not numericFeature):
+        for column in self._columnHeaders:
+            if(not pd.api.types.is_numeric_dtype(self._dataframe[column])):
                 raise IOError("The datafile has missing or invalid information.")
 
         # Ensure the outcome name is one of the column names,
@@ -74,20 +251,16 @@ class CalculateLinearModels:
         self._outcomeDataframe = self._dataframe[self._nameOutcome]
         self._featureDataframe = self._dataframe.drop([self._nameOutcome], axis=1).astype('float64')
 
-        # Generate all models. This will get expensive. The first for loop handles the number of
-        # features, and the second for loop handles all the possible combinations of that number
-        # of features.
+        # Generate all models. This will get expensive. The subset space is split
+        # into shards that are searched in this process or across a process pool.
         tic = time.time()
-        for i in range(1, self._maxFeatures + 1):
-            for combination in itertools.combinations(self._featureDataframe.columns.values.tolist(), i):
-                self._listModels.append(self.generateModel(combination))
+        if engine not in ('gram', 'statsmodels'):
+            raise ValueError("Unknown engine: " + str(engine))
+        self.searchSubsets(engine, workers)
         toc = time.time()
         print("Time to generate models:", (toc-tic), "seconds.")
 
-        self.mergeSort(self._listModels)
-        
-        for i in range(self._numModels):
-            self._listBestModels.append(self._listModels[i])
+        self._listBestModels = self._topModels.best()
         
         print("Model computation complete.")
     
@@ -101,7 +274,7 @@ class CalculateLinearModels:
             featureSet: The set of features to build a linear model with.
 
         Returns:
-            A list of a linear model and its RSS.
+            A list of a linear model, its RSS and the feature set.
         
         Raises:
             ValueError: One or more features in the feature set do not exist.
@@ -117,53 +290,75 @@ class CalculateLinearModels:
         regressionModel = tempModel.fit()
         RSS = ((regressionModel.predict(self._featureDataframe[list(featureSet)]) - self._outcomeDataframe) ** 2).sum()
 
-        return [regressionModel, RSS]
+        return [regressionModel, RSS, tuple(featureSet)]
+
+    def searchSubsets(self, engine='gram', workers=1):
+        """Scores every feature subset up to maxFeatures.
 
-    def mergeSort(self, list):
-        """The joys of computer science. This merge sort is designed to sort the model list by RSS
-        in ascending order. This will allow for the first n elements of the list to be the so called best models.
+        With the gram engine, X'X, X'y and y'y are computed once and every
+        subset is scored from them (see _searchGram). With the statsmodels
+        engine every subset is fit with sm.OLS. Either way only the RSS is
+        kept; the models that make the cut are refit by summarizeModels.
 
-        Inspired by the Python3 implementation of: https://www.geeksforgeeks.org/merge-sort/ 
+        Args:
+            engine: Either 'gram' or 'statsmodels'.
+            workers: The number of processes to shard the search across.
         """
-        if len(list) > 1:
-            list1 = list[:len(list)//2]
-            list2 = list[len(list)//2:]
-
-            # Activate the recursion!
-            self.mergeSort(list1)
-            self.mergeSort(list2)
-
-            i = j = k = 0
-
-            while(i < len(list1) or j < len(list2)):
-                if(i < len(list1) and j < len(list2)):
-                    if(list1[i][1] < list2[j][1]):
-                        list[k] = list1[i]
-                        i += 1
-                    else:
-                        list[k] = list2[j]
-                        j += 1
-                    k += 1
-                elif i < len(list1):
-                    list[k] = list1[i]
-                    i += 1
-                    k += 1
-                else:
-                    list[k] = list2[j]
-                    j += 1
-                    k += 1
-    
+        features = self._featureDataframe.columns.values.tolist()
+        data = np.empty((len(self._featureDataframe), len(features) + 1))
+        data[:, :-1] = self._featureDataframe.values
+        data[:, -1] = self._outcomeDataframe.values
+        gram = moment = outcomeSquares = None
+        if engine == 'gram':
+            gram = data[:, :-1].T @ data[:, :-1]
+            moment = data[:, :-1].T @ data[:, -1]
+            outcomeSquares = float(data[:, -1] @ data[:, -1])
+        settings = (features, self._maxFeatures, self._numModels, engine, gram, moment, outcomeSquares)
+        tasks = _subsetTasks(len(features), self._maxFeatures)
+
+        # pool processes map the matrix from shared memory instead of
+        # receiving a pickled copy with every task
+        try:
+            results = map_shared(_runTask, tasks, data, _initWorker, settings, workers)
+        finally:
+            _worker.clear()
+
+        for top in results:
+            self._topModels.merge(top)
+
     def summarizeModels(self):
         """
         A getter that prints out the regression model statistics for all of the "best" models.
         """
         for i in range(len(self._listBestModels)):
+            if self._listBestModels[i][0] is None:
+                self._listBestModels[i] = self.generateModel(self._listBestModels[i][2])
             print(self._listBestModels[i][0].summary())
             print("\n")
 
     def visualizeModels(self):
         """
         Create graphs of the regression models fit to the data.
+
+        Plots the RSS of every searched model against its number of
+        features, the lowest RSS reached at each size, and the kept models.
         """
+        sizes, RSS = self._topModels.distribution()
+        if len(RSS) == 0:
+            print("No models to visualize.")
+            return
+        steps = np.arange(1, sizes.max() + 1)
+        bestRSS = [RSS[sizes == step].min() for step in steps]
+
+        plt.figure()
+        plt.scatter(sizes, RSS, s=4, alpha=0.3, color='gray', label='All models')
+        plt.plot(steps, bestRSS, marker='o', color='tab:blue', label='Lowest RSS per size')
+        plt.scatter([len(model[2]) for model in self._listBestModels], [model[1] for model in self._listBestModels],
+                    marker='*', s=80, color='tab:red', zorder=3, label='Kept models')
+        plt.xlabel("Number of features")
+        plt.ylabel("RSS")
+        plt.title("RSS of " + str(len(RSS)) + " models for " + self._nameOutcome)
+        plt.legend()
+        plt.show()
 
         
\ No newline at end of file
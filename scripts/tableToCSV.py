@@ -1,78 +1,178 @@
 from google.cloud import bigquery
+from concurrent.futures import ThreadPoolExecutor
 
-import csv
+import argparse
+import json
+import os
 import os.path
+import time
 
-ALL_COLS = ("stn", "wban", "year", "mo", "da", "temp", "count_temp", "dewp", 
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from modeling.schema import MISSING_VALUES
+
+ALL_COLS = ("stn", "wban", "year", "mo", "da", "temp", "count_temp", "dewp",
     "count_dewp", "slp", "count_slp", "stp", "cound_stp", "visib", "count_visib",
     "wdsp", "count_wdsp", "mxpst", "gust", "max", "flag_max", "min", "flag_min",
     "prcp", "flag_prcp", "sndp", "fog", "rain_drizzle", "snow_ice_pellets",
     "hail", "thunder", "tornado_funnel_cloud")
 
-def get_full_table(year):
-    client = bigquery.Client()
+EXTENSIONS = {'parquet': 'parquet', 'csv': 'csv'}
+
+# Arrow types of BigQuery column types, for the Parquet schema
+ARROW_TYPES = {
+    'STRING': pa.string(),
+    'INTEGER': pa.int64(),
+    'INT64': pa.int64(),
+    'FLOAT': pa.float64(),
+    'FLOAT64': pa.float64(),
+    'NUMERIC': pa.decimal128(38, 9),
+    'BOOLEAN': pa.bool_(),
+    'BOOL': pa.bool_(),
+    'DATE': pa.date32(),
+    'TIMESTAMP': pa.timestamp('us', tz='UTC'),
+}
+
+def get_full_table(year, client=None):
+    client = client or bigquery.Client()
     gsod_dataset_ref = client.dataset('noaa_gsod', project='bigquery-public-data')
     gsod_dset = client.get_dataset(gsod_dataset_ref)
     gsod_full = client.get_table(gsod_dset.table(f'gsod{year}'))
 
     return  client.list_rows(gsod_full)
-    
-def is_bad_row(row, schema):
-    bad_dict = {
-        "temp": 9999.9,
-        "dewp": 9999.9,
-        "slp":  9999.9,
-        "stp":  9999.9,
-        "visib": 999.9,
-        "wdsp": 999.9,
-        "mxpsp": 999.9,
-        "gust": 999.9,
-        "max": 9999.9,
-        "min": 9999.9,
-        # "prcp": 99.99,  # prcp and sndp may need a deeper look than just this
-        # "sndp": 999.9,
-    }
-
-    for col in schema:
-        if col.name in bad_dict and row[col.name] == bad_dict[col.name]:
-            return True
-
-    return False
-
-def clean_table(table):
-    return [row for row in table if not is_bad_row(row, table.schema)]
 
-
-def table_to_csv(year):
-    # quick check to prevent duplicate requests
-    if os.path.exists(f'csv/gsod{year}.csv'):
-        print("File for this year already exists")
+def get_table_frames(year, client=None, bqstorage_client=None):
+    # the rows arrive as columnar pages, one DataFrame per page, along with
+    # the Arrow schema of the table
+    rows = get_full_table(year, client)
+    return arrow_schema(rows.schema), rows.to_dataframe_iterable(bqstorage_client=bqstorage_client)
+
+def arrow_schema(fields):
+    # taken from the table rather than inferred from the first page, where
+    # a column that is all null would get the null type
+    return pa.schema([pa.field(field.name, ARROW_TYPES.get(field.field_type, pa.string())) for field in fields])
+
+def clean_frame(frame):
+    # missing readings become nulls, as in the ingested store, and the row
+    # is kept for the columns it does have; returns the frame and the count
+    frame = frame.copy()
+    masked = 0
+    for col, sentinel in MISSING_VALUES.items():
+        if col in frame.columns:
+            missing = (frame[col] == sentinel).to_numpy(dtype=bool, na_value=False)
+            frame[col] = frame[col].mask(missing)
+            masked += int(missing.sum())
+    return frame, masked
+
+def manifest_path(year, directory, format):
+    return os.path.join(directory, f'gsod{year}.{EXTENSIONS[format]}.manifest.json')
+
+def read_manifest(year, directory, format):
+    try:
+        with open(manifest_path(year, directory, format)) as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def write_manifest(year, directory, manifest):
+    path = manifest_path(year, directory, manifest['format'])
+    with open(path + '.tmp', 'w') as file:
+        json.dump(manifest, file, indent=1)
+    os.replace(path + '.tmp', path)
+
+def is_exported(year, directory='csv', format='parquet'):
+    manifest = read_manifest(year, directory, format)
+    if manifest is None:
         return False
+    return manifest['rows'] == 0 or os.path.exists(os.path.join(directory, manifest['file']))
+
+class _FrameWriter():
+    def __init__(self, path, format, schema=None):
+        self.path = path
+        self.format = format
+        self._writer = None
+        self._schema = schema
+
+    def write(self, frame):
+        if self.format == 'csv':
+            frame.to_csv(self.path, mode='a', header=False, index=False)
+            return
+        if self._schema is None:
+            self._schema = pa.Table.from_pandas(frame, preserve_index=False).schema
+        table = pa.Table.from_pandas(frame, schema=self._schema, preserve_index=False)
+        if self._writer is None:
+            self._writer = pq.ParquetWriter(self.path, self._schema, compression='zstd')
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+def export_year(year, directory='csv', format='parquet', client=None, bqstorage_client=None, force=False):
+    # the manifest is only written once the data file is complete, so an
+    # interrupted export is simply redone
+    if not force and is_exported(year, directory, format):
+        print(f'{year} already exported')
+        return read_manifest(year, directory, format)
+
+    os.makedirs(directory, exist_ok=True)
+    file = f'gsod{year}.{EXTENSIONS[format]}'
+    path = os.path.join(directory, file)
+    if os.path.exists(path + '.tmp'):
+        os.remove(path + '.tmp')
 
-    # first, get the data
     print(f'Getting data for {year}')
-    full_table = get_full_table(year)
-    print("Table found, now cleaning")
-    cleaned_table = clean_table(full_table)
-
-    # check if any clean data was actually found
-    if len(cleaned_table) == 0:
+    start = time.perf_counter()
+    rows = 0
+    masked = 0
+    schema, frames = get_table_frames(year, client, bqstorage_client)
+    writer = _FrameWriter(path + '.tmp', format, schema)
+    try:
+        for frame in frames:
+            cleaned, count = clean_frame(frame)
+            masked += count
+            if len(cleaned):
+                writer.write(cleaned)
+                rows += len(cleaned)
+    finally:
+        writer.close()
+
+    if rows == 0:
         # if none was found, jump ship
-        print(f'No clean data was found for {year}. Exiting...')
-        return False
+        print(f'No clean data was found for {year}.')
+        if os.path.exists(path + '.tmp'):
+            os.remove(path + '.tmp')
+        file = None
     else:
-        print(f"{len(cleaned_table)} rows retrieved! Writing to file...")
-
-    # create a csv file, and a writer to fill it
-    csv_file = open(f'csv/gsod{year}.csv', 'w')
-    csv_writer = csv.writer(csv_file)
-
-    # fill the table using the data retrieved
-    csv_writer.writerows(cleaned_table)
+        os.replace(path + '.tmp', path)
+        print(f'{year}: {rows} rows written to {path} ({masked} missing readings)')
 
-    print("Done!")
+    manifest = {'year': year, 'format': format, 'file': file, 'rows': rows, 'masked': masked,
+                'seconds': time.perf_counter() - start, 'completed': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    write_manifest(year, directory, manifest)
+    return manifest
 
-    # close the file
-    csv_file.close()
+def export_years(years, directory='csv', format='parquet', workers=8, force=False):
+    # the export is network and file bound; threads share one client
+    client = bigquery.Client()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        manifests = pool.map(lambda year: export_year(year, directory, format, client=client, force=force), years)
+        return dict(zip(years, manifests))
 
-    return True
+def table_to_csv(year):
+    return export_year(year, 'csv', format='csv')['rows'] > 0
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export cleaned GSOD years from BigQuery.')
+    parser.add_argument('first', type=int, help='first year')
+    parser.add_argument('last', type=int, nargs='?', help='last year (inclusive)')
+    parser.add_argument('--format', choices=sorted(EXTENSIONS), default='parquet')
+    parser.add_argument('--dir', default='csv')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--force', action='store_true', help='re-export years that already have a manifest')
+    args = parser.parse_args()
+
+    years = list(range(args.first, (args.last or args.first) + 1))
+    manifests = export_years(years, args.dir, args.format, workers=args.workers, force=args.force)
+    print(f"Done! {sum(m['rows'] for m in manifests.values())} rows in {len(years)} years")
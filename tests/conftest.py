@@ -0,0 +1,13 @@
+import pytest
+from benchmarks.data import feature_names, synthetic_gsod
+
+COLUMNS = feature_names(8) + ['temp']
+
+@pytest.fixture
+def gsod_dir(tmp_path):
+    """Directory with small train.parquet and test.parquet GSOD tables."""
+    directory = tmp_path / 'gsod'
+    directory.mkdir()
+    synthetic_gsod(4000, 8, seed=0).to_parquet(directory / 'train.parquet', index=False)
+    synthetic_gsod(1000, 8, seed=1).to_parquet(directory / 'test.parquet', index=False)
+    return str(directory)
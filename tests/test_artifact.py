@@ -0,0 +1,25 @@
+import os
+import pytest
+from modeling import PolyReg, artifact
+from modeling.sources import LocalSource
+from conftest import COLUMNS
+
+def test_retrain_without_stats_drops_saved_stats(gsod_dir, tmp_path, monkeypatch):
+    path = str(tmp_path / 'model')
+    pm = PolyReg('stats', data_columns=COLUMNS, source=LocalSource(gsod_dir), max_rows=None)
+    pm.train(degree=2, solver='normal')
+    pm.save_file('model', dir_path=path)
+    assert artifact.read_header(path)['stats']['terms'] == pm.model.stats.n_terms
+    assert os.path.exists(os.path.join(path, 'stats.npz'))
+
+    monkeypatch.setattr('builtins.input', lambda prompt='': 'y')
+    pm.train(degree=1, solver='lstsq')
+    pm.save_file('model', dir_path=path)
+    assert artifact.read_header(path)['stats'] is None
+    assert not os.path.exists(os.path.join(path, 'stats.npz'))
+
+    loaded = PolyReg('stats', path=path)
+    assert loaded.model.stats is None
+    assert loaded.model.degree == 1
+    with pytest.raises(ValueError):
+        loaded.update(pm.test_data)
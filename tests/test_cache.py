@@ -0,0 +1,63 @@
+import os
+import numpy as np
+from benchmarks.data import synthetic_gsod
+from modeling import Dataset
+from modeling.cache import DatasetCache
+from modeling.sources import LocalSource
+from conftest import COLUMNS
+
+def test_sources_do_not_share_entries(gsod_dir, tmp_path):
+    other = tmp_path / 'other'
+    other.mkdir()
+    synthetic_gsod(3000, 8, seed=7).to_parquet(other / 'train.parquet', index=False)
+    cache = DatasetCache(str(tmp_path / 'cache'))
+    first = Dataset(columns=COLUMNS, source=LocalSource(str(other)), cache=cache)
+    second = Dataset(columns=COLUMNS, source=LocalSource(gsod_dir), cache=cache)
+    assert len(first.data) == 3000
+    assert len(second.data) == 4000
+    assert len(cache._manifest) == 2
+    fresh = Dataset(columns=COLUMNS, source=LocalSource(gsod_dir))
+    np.testing.assert_array_equal(second.array(COLUMNS), fresh.array(COLUMNS))
+
+class CountingSource(LocalSource):
+    def __init__(self, directory):
+        super().__init__(directory)
+        self.fetches = 0
+
+    def fetch(self, table_name, columns, max_rows=None, where=None):
+        self.fetches += 1
+        return super().fetch(table_name, columns, max_rows, where)
+
+def test_hits_skip_the_source(gsod_dir, tmp_path):
+    source = CountingSource(gsod_dir)
+    cache = DatasetCache(str(tmp_path / 'cache'))
+    first = Dataset(columns=COLUMNS, source=source, cache=cache)
+    second = Dataset(columns=COLUMNS, source=source, cache=cache)
+    assert source.fetches == 1
+    np.testing.assert_array_equal(first.array(COLUMNS), second.array(COLUMNS))
+    [entry] = cache.entries.values()
+    assert entry['hits'] == 1
+    reopened = DatasetCache(str(tmp_path / 'cache'))
+    Dataset(columns=COLUMNS, source=source, cache=reopened)
+    assert source.fetches == 1
+
+def test_different_loads_miss(gsod_dir, tmp_path):
+    source = CountingSource(gsod_dir)
+    cache = DatasetCache(str(tmp_path / 'cache'))
+    Dataset(columns=COLUMNS, source=source, cache=cache)
+    filtered = Dataset(columns=COLUMNS, source=source, cache=cache, data_where=[('mo', '==', 6)])
+    Dataset(columns=COLUMNS, source=source, cache=cache, max_size=100)
+    Dataset(columns=COLUMNS, source=source, cache=cache, compact=True)
+    assert source.fetches == 4
+    assert len(cache.entries) == 4
+    assert (filtered.data['mo'] == 6).all()
+
+def test_eviction_drops_least_recently_used(gsod_dir, tmp_path):
+    source = CountingSource(gsod_dir)
+    cache = DatasetCache(str(tmp_path / 'cache'), max_entries=2)
+    for month in (1, 2, 3):
+        Dataset(columns=COLUMNS, source=source, cache=cache, data_where=[('mo', '==', month)])
+    assert len(cache.entries) == 2
+    assert len(os.listdir(cache.directory)) == 3
+    Dataset(columns=COLUMNS, source=source, cache=cache, data_where=[('mo', '==', 1)])
+    assert source.fetches == 4
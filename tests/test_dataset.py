@@ -0,0 +1,26 @@
+import numpy as np
+from benchmarks.data import synthetic_gsod
+from modeling import Dataset, PolyReg
+from conftest import COLUMNS
+
+def write_shards(directory, rows=20000):
+    data = synthetic_gsod(rows, 8, seed=3)
+    directory.mkdir()
+    for i, start in enumerate(range(0, rows, 5000)):
+        data.iloc[start:start + 5000].to_parquet(directory / 'part-{}.parquet'.format(i), index=False)
+    return data
+
+def streamed_rows(dataset):
+    return sum(len(chunk) for chunk in dataset.iter_chunks(4096))
+
+def test_filtered_shard_load(tmp_path):
+    data = write_shards(tmp_path / 'shards')
+    expected = int((data['mo'] == 6).sum())
+    where = [('mo', '==', 6)]
+    assert streamed_rows(Dataset(columns=COLUMNS, shards=str(tmp_path / 'shards'), data_where=where)) == expected
+    pm = PolyReg('shards', data_columns=COLUMNS, train_shards=str(tmp_path / 'shards'),
+                 test_shards=str(tmp_path / 'shards'), data_where=where, test_where=[('mo', '==', 7)], compact=True)
+    assert streamed_rows(pm.train_data) == expected
+    assert streamed_rows(pm.test_data) == int((data['mo'] == 7).sum())
+    chunk = next(pm.train_data.iter_chunks(4096))
+    assert chunk['dewp'].dtype == np.float32
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+from modeling.expansion import PolynomialExpansion, accumulate, make_expansion
+from modeling.stats import SufficientStats
+
+FEATURES = ['mo', 'dewp', 'slp', 'fog', 'hail', 'thunder']
+
+def sample(rows=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([rng.integers(1, 13, rows), rng.normal(41.5, 20.6, rows), rng.normal(1014.2, 8.1, rows),
+                         rng.random(rows) < 0.3, rng.random(rows) < 0.01, rng.random(rows) < 0.05]).astype(np.float64)
+    y = 30 + 0.5 * X[:, 1] - 4 * X[:, 3] + 2 * X[:, 4] * X[:, 1] + rng.normal(0, 1, rows)
+    return X, y
+
+@pytest.mark.parametrize('degree', [1, 2, 3])
+@pytest.mark.parametrize('chunk_size', [5000, 700])
+def test_sparse_moments_match_dense_expansion(degree, chunk_size):
+    X, y = sample()
+    kernel = make_expansion(FEATURES, degree).fit(X)
+    sparse = SufficientStats(kernel.n_output_features_)
+    dense = SufficientStats(kernel.n_output_features_)
+    for start in range(0, len(X), chunk_size):
+        accumulate(sparse, kernel, X[start:start + chunk_size], y[start:start + chunk_size])
+        dense.update(kernel.transform(X[start:start + chunk_size]), y[start:start + chunk_size])
+    assert sparse.rows == dense.rows
+    np.testing.assert_allclose(sparse.mean, dense.mean, rtol=1e-10, atol=1e-12)
+    np.testing.assert_allclose(sparse.comoment, dense.comoment, rtol=1e-9, atol=1e-9 * np.abs(dense.comoment).max())
+
+def test_flag_powers_are_not_generated():
+    X, _ = sample(100)
+    powers = make_expansion(FEATURES, 3).fit(X).powers_
+    assert powers[:, 3:].max() == 1
+    full = PolynomialExpansion(degree=3).fit(X).powers_
+    assert set(map(tuple, powers)) == set(map(tuple, full[full[:, 3:].max(axis=1) <= 1]))
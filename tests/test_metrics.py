@@ -0,0 +1,56 @@
+import numpy as np
+import pytest
+from sklearn.metrics import explained_variance_score, mean_absolute_error, mean_squared_error, r2_score
+from modeling.metrics import RunningMetrics, regression_metrics
+
+def reference(y_true, y_pred, weights):
+    return {'R-Squared': r2_score(y_true, y_pred, sample_weight=weights),
+            "Explained Variance": explained_variance_score(y_true, y_pred, sample_weight=weights),
+            'Root Mean Squared Error': np.sqrt(mean_squared_error(y_true, y_pred, sample_weight=weights)),
+            'Mean Absolute Error': mean_absolute_error(y_true, y_pred, sample_weight=weights)}
+
+def sample(rows=100003, seed=0):
+    rng = np.random.default_rng(seed)
+    y_true = rng.normal(55.7, 23.3, rows)
+    y_pred = y_true + rng.normal(0.5, 3.0, rows)
+    return y_true, y_pred, rng.random(rows)
+
+@pytest.mark.parametrize('weighted', [False, True])
+@pytest.mark.parametrize('chunk_size', [65536, 1000, 7])
+def test_regression_metrics_match_sklearn(weighted, chunk_size):
+    y_true, y_pred, weights = sample()
+    weights = weights if weighted else None
+    expected = reference(y_true, y_pred, weights)
+    results = regression_metrics(y_true, y_pred, sample_weight=weights, chunk_size=chunk_size)
+    assert set(results) == set(expected)
+    for name, value in results.items():
+        assert value == pytest.approx(expected[name], rel=1e-9, abs=1e-12), name
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_compact_inputs_match_sklearn(weighted):
+    y_true, y_pred, weights = sample()
+    y_true, y_pred = y_true.astype(np.float32), y_pred.astype(np.float32)
+    weights = weights if weighted else None
+    expected = reference(y_true.astype(np.float64), y_pred.astype(np.float64), weights)
+    for name, value in regression_metrics(y_true, y_pred, sample_weight=weights).items():
+        assert value == pytest.approx(expected[name], rel=1e-9, abs=1e-12), name
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_merged_running_metrics_match_sklearn(weighted):
+    y_true, y_pred, weights = sample()
+    weights = weights if weighted else None
+    parts = []
+    for start, stop in ((0, 40000), (40000, 40001), (40001, len(y_true))):
+        part = RunningMetrics()
+        part.update(y_true[start:stop], y_pred[start:stop], None if weights is None else weights[start:stop])
+        parts.append(part)
+    merged = parts[0].merge(parts[1]).merge(parts[2])
+    assert merged.n == len(y_true)
+    expected = reference(y_true, y_pred, weights)
+    for name, value in merged.results().items():
+        assert value == pytest.approx(expected[name], rel=1e-9, abs=1e-12), name
+
+def test_empty_metrics():
+    assert regression_metrics(np.empty(0), np.empty(0)) is None
+    with pytest.raises(ValueError):
+        regression_metrics(np.zeros(3), np.zeros(2))
@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import pytest
+from modeling import Dataset
+from modeling.filters import Filter
+from modeling.sources import LocalSource, LocalStorageClient
+from conftest import COLUMNS
+
+class RecordingClient(LocalStorageClient):
+    def __init__(self, source):
+        super().__init__(source)
+        self.restrictions = []
+
+    def create_read_session(self, table_reference, parent, read_options=None, **kwargs):
+        self.restrictions.append(read_options.row_restriction)
+        return super().create_read_session(table_reference, parent, read_options=read_options, **kwargs)
+
+def expected_rows(gsod_dir, mask):
+    data = pd.read_parquet(gsod_dir + '/train.parquet', columns=COLUMNS)
+    return data.loc[mask(data)].reset_index(drop=True)
+
+@pytest.mark.parametrize('streams', [1, 3])
+def test_filter_is_pushed_to_storage_client(gsod_dir, streams):
+    where = [('mo', 'in', [6, 7, 8]), ('dewp', '>', 40.0)]
+    client = RecordingClient(gsod_dir)
+    dataset = Dataset(columns=COLUMNS, storage_client=client, data_where=where, streams=streams)
+    assert client.restrictions == [Filter.coerce(where).to_sql()]
+    expected = expected_rows(gsod_dir, lambda d: d['mo'].isin([6, 7, 8]) & (d['dewp'] > 40.0))
+    np.testing.assert_array_equal(dataset.array(COLUMNS), expected.to_numpy(dtype=np.float64))
+
+def test_unfiltered_read_has_no_restriction(gsod_dir):
+    client = RecordingClient(gsod_dir)
+    dataset = Dataset(columns=COLUMNS, storage_client=client, streams=2)
+    assert client.restrictions == ['']
+    assert len(dataset.data) == 4000
+
+def test_csv_source_applies_filter(gsod_dir, tmp_path):
+    pd.read_parquet(gsod_dir + '/train.parquet').to_csv(tmp_path / 'train.csv', index=False)
+    dataset = Dataset(columns=COLUMNS, source=LocalSource(str(tmp_path)), data_where=[('mo', '==', 6)])
+    expected = expected_rows(gsod_dir, lambda d: d['mo'] == 6)
+    np.testing.assert_allclose(dataset.array(COLUMNS), expected.to_numpy(dtype=np.float64))
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from modeling.stats import SufficientStats
+
+def design(rows=20000, seed=0):
+    # columns on very different scales, as GSOD pressure, visibility and flags are
+    rng = np.random.default_rng(seed)
+    X = rng.normal(0.0, 1.0, (rows, 5)) * np.array([1e-3, 1.0, 10.0, 1e3, 1e4]) + np.array([0.0, 5.0, -3.0, 1e4, 0.0])
+    y = X @ np.array([2e3, -1.5, 0.25, 3e-3, -1e-4]) + 7.0 + rng.normal(0.0, 0.5, rows)
+    return X, y
+
+def scaled_lstsq(X, y):
+    # reference fit on centered, unit-variance columns, mapped back
+    mean, scale = X.mean(axis=0), X.std(axis=0)
+    coef = np.linalg.lstsq((X - mean) / scale, y - y.mean(), rcond=None)[0] / scale
+    return coef, y.mean() - mean @ coef
+
+def accumulated(X, y, chunk_size):
+    stats = SufficientStats(X.shape[1])
+    for start in range(0, len(X), chunk_size):
+        stats.update(X[start:start + chunk_size], y[start:start + chunk_size])
+    return stats
+
+@pytest.mark.parametrize('chunk_size', [20000, 4096, 333])
+def test_solve_matches_scaled_lstsq(chunk_size):
+    X, y = design()
+    coef, intercept = accumulated(X, y, chunk_size).solve()
+    expected_coef, expected_intercept = scaled_lstsq(X, y)
+    np.testing.assert_allclose(coef, expected_coef, rtol=1e-8)
+    assert intercept == pytest.approx(expected_intercept, rel=1e-8)
+
+def test_rank_deficient_solve_is_minimum_norm():
+    X, y = design(5000)
+    X = np.column_stack([X, X[:, 1], np.ones(len(X))])
+    coef, intercept = accumulated(X, y, 1000).solve()
+    expected = np.linalg.lstsq(np.column_stack([X[:, :-1], np.ones(len(X))]), y, rcond=None)[0]
+    assert coef[-1] == 0.0
+    assert coef[1] == pytest.approx(coef[5], rel=1e-8)
+    np.testing.assert_allclose(X[:, :-1] @ coef[:-1] + intercept, X[:, :-1] @ expected[:-1] + expected[-1], rtol=1e-8)
+
+def test_downdate_matches_fresh_statistics():
+    X, y = design()
+    total = accumulated(X, y, 5000)
+    part = accumulated(X[:6000], y[:6000], 5000)
+    rest = accumulated(X[6000:], y[6000:], 5000)
+    downdated = total - part
+    assert downdated.rows == rest.rows
+    np.testing.assert_allclose(downdated.mean, rest.mean, rtol=1e-9, atol=1e-9)
+    np.testing.assert_allclose(downdated.comoment, rest.comoment, rtol=1e-7, atol=1e-6 * np.abs(rest.comoment).max())
+    np.testing.assert_allclose(downdated.solve()[0], rest.solve()[0], rtol=1e-6)